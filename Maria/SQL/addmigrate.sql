@@ -0,0 +1,15 @@
+-- adds the admin user that runs migrate.py, see migrate.py for schema versions
+-- run migrate.py after this, the station writes w_dir_code once the table is swapped:
+--   python3 migrate.py --config json_admin.load
+-- run migrate.py monthly to add partitions, --drop-before YYYY-MM drops old months
+USE `weather_data`;
+CREATE TABLE IF NOT EXISTS `schema_version` (
+`version` INT NOT NULL PRIMARY KEY,
+`applied` TIMESTAMP NOT NULL DEFAULT current_timestamp,
+`description` VARCHAR(255) NULL
+);
+DROP USER IF EXISTS 'admin'@'localhost';
+CREATE USER 'admin'@'localhost' IDENTIFIED BY '123456';
+GRANT SELECT, INSERT, UPDATE, DELETE, CREATE, DROP, ALTER, INDEX ON weather_data.* TO 'admin'@'localhost';
+GRANT SELECT ON weather_data.schema_version TO 'frontend'@'localhost';
+FLUSH PRIVILEGES;
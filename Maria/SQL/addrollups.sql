@@ -0,0 +1,38 @@
+-- adds hourly, daily and monthly rollups of sensors, see rollups.py
+-- one row per station and bucket, per measurement: min, max, sum and count of
+-- non NULL values, mean = sum / count
+-- safe to run again, existing rollups are kept and older tables get station_id
+-- set WS_ROLLUPS to "True" in the backend json file to update them with each insert
+-- fill from existing rows with: python3 rollups.py --config json_backend_private.load
+USE `weather_data`;
+CREATE TABLE IF NOT EXISTS `sensors_hourly` (
+`station_id` SMALLINT UNSIGNED NOT NULL DEFAULT 1,
+`bucket` DATETIME NOT NULL,
+`samples` INT NOT NULL DEFAULT 0,
+`ws_ave_min` FLOAT NULL, `ws_ave_max` FLOAT NULL, `ws_ave_sum` DOUBLE NOT NULL DEFAULT 0, `ws_ave_count` INT NOT NULL DEFAULT 0,
+`ws_max_min` FLOAT NULL, `ws_max_max` FLOAT NULL, `ws_max_sum` DOUBLE NOT NULL DEFAULT 0, `ws_max_count` INT NOT NULL DEFAULT 0,
+`humid_min` FLOAT NULL, `humid_max` FLOAT NULL, `humid_sum` DOUBLE NOT NULL DEFAULT 0, `humid_count` INT NOT NULL DEFAULT 0,
+`press_min` FLOAT NULL, `press_max` FLOAT NULL, `press_sum` DOUBLE NOT NULL DEFAULT 0, `press_count` INT NOT NULL DEFAULT 0,
+`temp_min` FLOAT NULL, `temp_max` FLOAT NULL, `temp_sum` DOUBLE NOT NULL DEFAULT 0, `temp_count` INT NOT NULL DEFAULT 0,
+`therm_min` FLOAT NULL, `therm_max` FLOAT NULL, `therm_sum` DOUBLE NOT NULL DEFAULT 0, `therm_count` INT NOT NULL DEFAULT 0,
+`rain_min` FLOAT NULL, `rain_max` FLOAT NULL, `rain_sum` DOUBLE NOT NULL DEFAULT 0, `rain_count` INT NOT NULL DEFAULT 0,
+ PRIMARY KEY (`station_id`, `bucket`)
+);
+CREATE TABLE IF NOT EXISTS `sensors_daily` LIKE `sensors_hourly`;
+CREATE TABLE IF NOT EXISTS `sensors_monthly` LIKE `sensors_hourly`;
+-- tables made before rollups were kept per station, rows become station 1
+ALTER TABLE `sensors_hourly` ADD COLUMN IF NOT EXISTS `station_id` SMALLINT UNSIGNED NOT NULL DEFAULT 1 FIRST,
+ DROP PRIMARY KEY, ADD PRIMARY KEY (`station_id`, `bucket`);
+ALTER TABLE `sensors_daily` ADD COLUMN IF NOT EXISTS `station_id` SMALLINT UNSIGNED NOT NULL DEFAULT 1 FIRST,
+ DROP PRIMARY KEY, ADD PRIMARY KEY (`station_id`, `bucket`);
+ALTER TABLE `sensors_monthly` ADD COLUMN IF NOT EXISTS `station_id` SMALLINT UNSIGNED NOT NULL DEFAULT 1 FIRST,
+ DROP PRIMARY KEY, ADD PRIMARY KEY (`station_id`, `bucket`);
+-- backend recomputes rollups from sensors with each insert and to rebuild them
+GRANT SELECT ON weather_data.sensors TO 'backend'@'localhost';
+GRANT SELECT, INSERT, UPDATE, DELETE ON weather_data.sensors_hourly TO 'backend'@'localhost';
+GRANT SELECT, INSERT, UPDATE, DELETE ON weather_data.sensors_daily TO 'backend'@'localhost';
+GRANT SELECT, INSERT, UPDATE, DELETE ON weather_data.sensors_monthly TO 'backend'@'localhost';
+GRANT SELECT ON weather_data.sensors_hourly TO 'frontend'@'localhost';
+GRANT SELECT ON weather_data.sensors_daily TO 'frontend'@'localhost';
+GRANT SELECT ON weather_data.sensors_monthly TO 'frontend'@'localhost';
+FLUSH PRIVILEGES;
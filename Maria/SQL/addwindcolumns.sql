@@ -0,0 +1,7 @@
+-- adds optional wind columns, used with main(wind_columns=True)
+USE `weather_data`;
+ALTER TABLE `sensors`
+ADD COLUMN `w_dir_deg` FLOAT NULL,
+ADD COLUMN `w_dir_wdeg` FLOAT NULL,
+ADD COLUMN `w_dir_std` FLOAT NULL,
+ADD COLUMN `ws_lull` FLOAT NULL;
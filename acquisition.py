@@ -0,0 +1,68 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+"""Acquisition reads the slow sensors (BME280, DS18B20) in parallel threads
+while the wind measurement is still running, so their latency is hidden
+inside the wind window instead of being added after it. start() is called
+shortly before the end of the window and collect() at the end.
+Each sensor has its own timeout, collect() waits at most that long after
+the window ends. A sensor that does not answer in time gives None and does
+not hold up the record longer."""
+
+
+class SensorAcquisition:
+    def __init__(self):
+        # (name, read function, timeout in seconds)
+        self.sensors = []
+        self.futures = {}
+        self.executor = None
+
+    # Sensors are added before the first start()
+    def add_sensor(self, name, read, timeout):
+        self.sensors.append((name, read, timeout))
+
+    # Starts every sensor read, a read still running from last time is kept
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=len(self.sensors), thread_name_prefix="Acquisition"
+            )
+        for name, read, timeout in self.sensors:
+            future = self.futures.get(name)
+            if future is not None and not future.done():
+                logging.warning("ACQ: %s still busy, not started", name)
+                continue
+            self.futures[name] = self.executor.submit(read)
+
+    """
+    Returns dict of sensor name to reading. A sensor that failed, timed out,
+    or was not started is None.
+    """
+
+    def collect(self):
+        # Timeouts count from the end of the window
+        end = time.monotonic()
+        readings = {}
+        for name, read, timeout in self.sensors:
+            future = self.futures.get(name)
+            readings[name] = None
+            if future is None:
+                continue
+            try:
+                remaining = max(0.0, end + timeout - time.monotonic())
+                readings[name] = future.result(timeout=remaining)
+            except TimeoutError:
+                logging.warning("ACQ: %s timed out", name)
+                continue
+            except Exception as e:
+                logging.warning("ACQ: %s failed: %s", name, e)
+            # Done, next start() reads again
+            self.futures[name] = None
+        return readings
+
+    # Stops the worker threads, a read still running is left to finish
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
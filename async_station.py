@@ -0,0 +1,326 @@
+import asyncio
+import logging
+from datetime import datetime
+
+import numpy as np
+
+import hardware
+from hardware import clock
+
+# Sensor modules
+import bme280_sensor
+import ds18b20_therm
+
+# local modules
+import wind_direction
+import pulse_buffer
+import jim_weather_station as station
+from data_mgr import DataMgr
+from scheduler import Scheduler
+
+"""asyncio version of jim_weather_station.main().
+
+Every sensor is a task on one event loop with its own period: the vane
+is read vane_rate times a second, the BME280 and DS18B20 are read in
+executor threads with a timeout. Anemometer and rain gauge interrupts arrive
+on gpiozero's thread and are passed to the loop with call_soon_threadsafe(),
+so pulse times and counts are only ever changed by the loop and need no
+globals or locks.
+
+The record task builds a record at each interval boundary from the latest
+values, and the sinks are written at the same time by
+DataMgr.update_entries_async() while the loop keeps sampling.
+
+Column names, constants and the GPIO buttons are shared with
+jim_weather_station.py. With WS_HARDWARE=sim the loop runs on simulated time."""
+
+
+class AsyncStation:
+    """
+    db_mgr: DataMgr the records are written to
+    record_vars2params: names of values in each record, see vars2params
+    measurement_time: seconds per wind speed sample
+    interval: seconds per record
+    vane_rate: vane samples per second
+    bme_period, therm_period: seconds between reads, a record has the latest
+    """
+
+    def __init__(
+        self,
+        db_mgr,
+        record_vars2params,
+        measurement_time=station.WIND_MEASUREMENT_TIME,
+        interval=station.WIND_MEASUREMENT_INTERVAL * 60,
+        vane_rate=20,
+        bme_period=60,
+        therm_period=60,
+    ):
+        self.db_mgr = db_mgr
+        self.record_vars2params = record_vars2params
+        self.measurement_time = measurement_time
+        self.interval = interval
+        self.vane_rate = vane_rate
+        self.bme_period = bme_period
+        self.therm_period = therm_period
+        self.scheduler = Scheduler(clock)
+
+        self.bme = bme280_sensor.BME280Sensor()
+        self.therm = ds18b20_therm.DS18B20(read_timeout=station.DS18B20_TIMEOUT - 0.5)
+        self.direction = wind_direction.WindDirection()
+
+        # Changed only by the event loop. Wind speed samples are counted
+        # from the pulse timestamps when a record is built
+        self.rain_count = 0
+        self.wind_pulses = pulse_buffer.PulseRingBuffer()
+        # Vane samples of the current record, (time, code)
+        self.vane_samples = []
+        # Latest reading of each executor backed sensor, None until read
+        self.latest = {"bme": None, "therm": None}
+        # Sink write of the previous record, records are written in order
+        self.write_task = None
+        self.record_count = 0
+
+    # Interrupt handlers run on the GPIO thread, the timestamp is taken there
+    def attach(self, loop):
+        station.wind_speed_sensor.when_activated = lambda: loop.call_soon_threadsafe(
+            self._spin, clock.monotonic_ns()
+        )
+        station.rain_sensor.when_pressed = lambda: loop.call_soon_threadsafe(
+            self._bucket_tipped
+        )
+
+    def _spin(self, timestamp_ns):
+        self.wind_pulses.record(timestamp_ns)
+
+    def _bucket_tipped(self):
+        self.rain_count += 1
+
+    async def _sleep_until(self, deadline):
+        await asyncio.sleep(max(0.0, deadline - clock.monotonic()))
+
+    # Samples on a fixed grid, a late sample does not move later ones
+    async def _vane(self, start):
+        period = 1.0 / self.vane_rate
+        deadline = start
+        while True:
+            self.vane_samples.append(
+                (clock.monotonic(), self.direction.get_direction_code())
+            )
+            deadline = self.scheduler.next_deadline(deadline, period)
+            await self._sleep_until(deadline)
+
+    """
+    Reads a sensor in an executor thread every period seconds. A read not
+    done within timeout leaves the latest value None, a read still running
+    is not started again.
+    """
+
+    async def _sensor(self, name, read, period, timeout, start):
+        loop = asyncio.get_running_loop()
+        deadline = start
+        future = None
+        while True:
+            if future is not None and not future.done():
+                logging.warning("ASYNC: %s still busy, not started", name)
+            else:
+                future = loop.run_in_executor(None, read)
+                try:
+                    self.latest[name] = await asyncio.wait_for(
+                        asyncio.shield(future), timeout
+                    )
+                except asyncio.TimeoutError:
+                    logging.warning("ASYNC: %s timed out", name)
+                    self.latest[name] = None
+                except Exception as e:
+                    logging.warning("ASYNC: %s failed: %s", name, e)
+                    self.latest[name] = None
+            deadline = self.scheduler.next_deadline(deadline, period)
+            await self._sleep_until(deadline)
+
+    # Takes the samples of the record ending at end, leaves later ones
+    def _take(self, samples, end):
+        split = 0
+        while split < len(samples) and samples[split][0] <= end:
+            split += 1
+        taken = samples[:split]
+        del samples[:split]
+        return taken
+
+    """
+    Builds one record at each interval boundary, from start. Returns after
+    max_records records, never if None.
+    """
+
+    async def _records(self, start, max_records):
+        end = start + self.interval
+        while max_records is None or self.record_count < max_records:
+            await self._sleep_until(end)
+            record_start = end - self.interval
+
+            rainfall = round(self.rain_count * station.BUCKET_SIZE, 3)
+            self.rain_count = 0
+
+            vane = self._take(self.vane_samples, end)
+            params = self._record(record_start, end, vane, rainfall)
+
+            # Previous write must be done first, the next record waits for
+            # a slow sink but sampling does not
+            if self.write_task is not None:
+                await self.write_task
+            self.write_task = asyncio.create_task(
+                self.db_mgr.update_entries_async(params)
+            )
+            self.record_count += 1
+
+            end = self.scheduler.next_deadline(end, self.interval)
+
+        if self.write_task is not None:
+            await self.write_task
+
+    """
+    Speed samples are the pulses in each measurement_time slice of the
+    record, the same samples WindSpeedDirThread takes with its sleep loop.
+    """
+
+    def _record(self, record_start, end, vane, rainfall):
+        start_ns = int(record_start * 1e9)
+        end_ns = int(end * 1e9)
+        pulses = self.wind_pulses.window(start_ns, end_ns)
+
+        slices = max(1, int(round(self.interval / self.measurement_time)))
+        edges = np.linspace(start_ns, end_ns, slices + 1).astype(np.int64)
+        counts = np.diff(np.searchsorted(pulses, edges, side="left"))
+        speed_data = counts / (np.diff(edges) / 1e9) * station.KMH_PER_HZ
+
+        if len(vane):
+            times = np.array([t for t, _ in vane])
+            codes = wind_direction.majority_filter(
+                np.array([code for _, code in vane], dtype=np.uint8)
+            )
+            valid = codes != wind_direction.NO_DIRECTION
+            directions = codes[valid] * wind_direction.DEGREES_PER_POINT
+            # Pair each vane sample with the speed of the sample it fell in
+            index = ((times[valid] - record_start) / self.measurement_time).astype(int)
+            paired = speed_data[np.clip(index, 0, slices - 1)]
+        else:
+            directions = paired = np.zeros(0)
+
+        wind_vector = wind_direction.wind_vector_statistics(paired, directions)
+        wind_stats = pulse_buffer.wind_statistics(
+            pulses, start_ns, end_ns, station.KMH_PER_HZ
+        )
+
+        bme_reading = self.latest["bme"]
+        if bme_reading is None:
+            bme_reading = bme280_sensor.BME280Reading(
+                None, None, None, None, None, "not read"
+            )
+
+        # Record is stamped with the start of its interval, as in
+        # jim_weather_station.measurement_loop()
+        values = {
+            "current_time": datetime.fromtimestamp(
+                round(self.scheduler.wall_time(record_start))
+            ).strftime("%Y-%m-%d %H:%M:%S"),
+            "wind_speed_average": round(float(speed_data.mean()), 1),
+            "wind_speed_gust": round(wind_stats.gust, 1),
+            "wind_direction_value": wind_direction.compass_point(
+                wind_vector.direction
+            ),
+            "humidity": station.optional_round(bme_reading.humidity),
+            "pressure": station.optional_round(bme_reading.pressure),
+            "temperature": station.optional_round(bme_reading.temperature),
+            "ground_temperature": station.optional_round(self.latest["therm"]),
+            "rainfall": rainfall,
+            "wind_direction_degrees": station.optional_round(wind_vector.direction),
+            "wind_direction_weighted": station.optional_round(
+                wind_vector.weighted_direction
+            ),
+            "wind_direction_std": station.optional_round(wind_vector.direction_std),
+            "wind_speed_lull": round(wind_stats.lull, 1),
+        }
+        logging.info("ASYNC: Record at %s", values["current_time"])
+        return tuple(values[var] for var in self.record_vars2params)
+
+    """
+    Runs the station until max_records records are written, forever if
+    None. Sensors are read ahead of the first record so it has values.
+    """
+
+    async def run(self, max_records=None):
+        self.attach(asyncio.get_running_loop())
+
+        # Just to be neat, Set start time to occur when second changes
+        start = self.scheduler.deadline_at(int(clock.time()) + 1)
+        await self._sleep_until(start)
+
+        tasks = [
+            asyncio.create_task(
+                self._sensor(
+                    "bme",
+                    self.bme.read,
+                    self.bme_period,
+                    station.BME280_TIMEOUT,
+                    start,
+                )
+            ),
+            asyncio.create_task(
+                self._sensor(
+                    "therm",
+                    self.therm.read_first,
+                    self.therm_period,
+                    station.DS18B20_TIMEOUT,
+                    start,
+                )
+            ),
+        ]
+        if self.vane_rate > 0:
+            tasks.append(asyncio.create_task(self._vane(start)))
+
+        try:
+            await self._records(start, max_records)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+"""kwargs is passed to db_mgr and are used to configure how data is stored,
+same as jim_weather_station.main()"""
+
+
+def main(**kwargs):
+    max_records = kwargs.pop("max_records", None)
+    vane_rate = kwargs.pop("vane_rate", 20)
+
+    record_column_names = list(station.column_names)
+    record_vars2params = list(station.vars2params)
+    if kwargs.pop("wind_columns", False):
+        record_column_names += station.wind_column_names
+        record_vars2params += station.wind_vars2params
+
+    try:
+        db_mgr = DataMgr(record_column_names, **kwargs)
+    except Exception as e:
+        logging.error("Error Cannot open data storage: %s", e)
+        raise
+
+    weather_station = AsyncStation(db_mgr, record_vars2params, vane_rate=vane_rate)
+    loop = hardware.new_event_loop()
+    try:
+        loop.run_until_complete(weather_station.run(max_records))
+    finally:
+        # Writes queued entries, anything not written stays in spool file
+        db_mgr.close()
+        loop.close()
+
+
+if __name__ == "__main__":
+    try:
+        main(
+            db_config="json_backend_private.load",
+            spool_config="weather_station.spool",
+        )
+    except Exception as e:
+        logging.exception("Exception in main(): ")
+        logging.warning("Error Exception in main(): %s", e)
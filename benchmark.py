@@ -0,0 +1,115 @@
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import statistics
+
+"""Benchmark of the weather station pipeline on simulated hardware, runs on
+any machine. See sim_hardware.py.
+
+1. Runs jim_weather_station.main() for --hours of simulated time into CSV,
+   flat file, columnar file and a SQLite stand-in for MariaDB, reports records per second.
+2. Sends --records records through DataMgr and reports the latency of each
+   storage stage.
+
+python3 benchmark.py --hours 24 --records 2000"""
+
+# Must be set before any sensor module imports hardware.py
+os.environ["WS_HARDWARE"] = "sim"
+
+import jim_weather_station
+from data_mgr import DataMgr
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(name, values):
+    print(
+        "  {:<10} mean {:8.3f} ms   p95 {:8.3f} ms   max {:8.3f} ms".format(
+            name,
+            statistics.mean(values) * 1000,
+            percentile(values, 0.95) * 1000,
+            max(values) * 1000,
+        )
+    )
+
+
+def storage_config(directory):
+    return {
+        "mariadb": True,
+        "sim_db": os.path.join(directory, "sim_db.sqlite"),
+        "csv_config": os.path.join(directory, "csv_data.txt"),
+        "flat_config": os.path.join(directory, "flat_data.txt"),
+        "columnar_config": os.path.join(directory, "columnar_data.bin"),
+        "spool_config": os.path.join(directory, "weather_station.spool"),
+    }
+
+
+def station_run(directory, hours):
+    os.mkdir(directory)
+    records = int(hours * 60 / jim_weather_station.WIND_MEASUREMENT_INTERVAL)
+    start = time.perf_counter()
+    jim_weather_station.main(max_records=records, **storage_config(directory))
+    elapsed = time.perf_counter() - start
+
+    print("Simulated station, {} hours, {} records".format(hours, records))
+    print(
+        "  {:.2f} s, {:.1f} records/s, {:.0f}x real time".format(
+            elapsed, records / elapsed, hours * 3600 / elapsed
+        )
+    )
+
+
+def storage_run(directory, records):
+    os.mkdir(directory)
+    column_names = jim_weather_station.column_names
+    db_mgr = DataMgr(column_names, **storage_config(directory))
+
+    latency = {"total": []}
+    start = time.perf_counter()
+    for count in range(records):
+        params = (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1622505600 + count * 300)),
+            12.3,
+            25.6,
+            "NNE",
+            71.2,
+            1013.4,
+            15.3,
+            12.1,
+            0.279,
+        )
+        update_start = time.perf_counter()
+        db_mgr.update_entries(params)
+        latency["total"].append(time.perf_counter() - update_start)
+        for sink, seconds in db_mgr.sink_latency.items():
+            latency.setdefault(sink, []).append(seconds)
+    elapsed = time.perf_counter() - start
+    db_mgr.close()
+
+    print("DataMgr, {} records".format(records))
+    print("  {:.2f} s, {:.1f} records/s".format(elapsed, records / elapsed))
+    for name, values in latency.items():
+        report(name, values)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Weather station benchmark")
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--records", type=int, default=2000)
+    args = parser.parse_args()
+
+    # Station logs every sample at INFO, keep benchmark output readable
+    logging.getLogger("").setLevel(logging.WARNING)
+
+    directory = tempfile.mkdtemp(prefix="ws_bench_")
+    try:
+        station_run(os.path.join(directory, "station"), args.hours)
+        storage_run(os.path.join(directory, "storage"), args.records)
+    finally:
+        shutil.rmtree(directory)
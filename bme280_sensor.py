@@ -1,44 +1,140 @@
-from time import sleep
+import logging
+from collections import namedtuple
 
-import bme280
-import smbus2
+from hardware import bme280, smbus2, clock
 
+CHIP_ID_REGISTER = 0xD0
+CHIP_ID = 0x60
+CONFIG_REGISTER = 0xF5
 
-class temperature_sensor:
-    def __init__(self):
-        self.port = 1
-        self.address = 0x77  # Adafruit BME280 address. Other BME280s may be different
+# IIR filter coefficient to config register code, 0 is filter off
+IIR_FILTER = {0: 0, 2: 1, 4: 2, 8: 3, 16: 4}
+
+
+class BME280Reading(
+    namedtuple(
+        "BME280Reading",
+        ["humidity", "pressure", "temperature", "address", "latency", "error"],
+    )
+):
+    """Result of one read. A failed read has error set and None values."""
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BME280Sensor:
+    """
+    Temperature, humidity and pressure sensor on I2C.
+    addresses: addresses to use, sensors not found at start up are skipped
+    oversampling: "x1", "x2", "x4", "x8" or "x16", for all three measurements
+    iir_filter: IIR filter coefficient, 0 (off), 2, 4, 8 or 16
+
+    Calibration is read once per sensor and kept, each read is one forced
+    mode measurement read back in one I2C block transfer.
+    """
+
+    def __init__(self, addresses=(0x77, 0x76), port=1, oversampling="x1", iir_filter=0):
+        self.port = port
         self.bus = smbus2.SMBus(self.port)
+        self.sampling = getattr(bme280.oversampling, oversampling)
+        self.iir_filter = IIR_FILTER[iir_filter]
 
-    def read_all_bme820(self):
+        # Calibration per address, None until loaded
+        self.calibration = {}
+        for address in addresses:
+            if self._probe(address):
+                self.calibration[address] = None
+                self._configure(address)
+
+        if not self.calibration:
+            # Keep going, every read returns an error result
+            logging.error("BME280: No sensor found at %s", [hex(a) for a in addresses])
+            self.calibration = {address: None for address in addresses}
+
+        self.addresses = list(self.calibration)
+
+    def _probe(self, address):
+        try:
+            return self.bus.read_byte_data(address, CHIP_ID_REGISTER) == CHIP_ID
+        except OSError:
+            return False
+
+    # Loads calibration and sets IIR filter, filter is kept between reads
+    def _configure(self, address):
         try:
-            bme280_data = bme280.sample(self.bus, self.address)
+            self.calibration[address] = bme280.load_calibration_params(
+                self.bus, address
+            )
+            self.bus.write_byte_data(address, CONFIG_REGISTER, self.iir_filter << 2)
         except Exception as e:
-            # print debuglog statement
-            return None, None, None
+            logging.warning("BME280: Configure %s failed: %s", hex(address), e)
+            self.calibration[address] = None
 
-        return bme280_data.humidity, bme280_data.pressure, bme280_data.temperature
+    # Reads one sensor, first one found if address is None
+    def read(self, address=None):
+        if address is None:
+            address = self.addresses[0]
 
-    # bme280_load_calibration_params(bus, address)
+        start = clock.perf_counter()
+        try:
+            if self.calibration[address] is None:
+                self._configure(address)
+            if self.calibration[address] is None:
+                raise OSError("no calibration for " + hex(address))
+            data = bme280.sample(
+                self.bus, address, self.calibration[address], self.sampling
+            )
+        except Exception as e:
+            latency = clock.perf_counter() - start
+            logging.warning("BME280: Read %s failed: %s", hex(address), e)
+            # Calibration is read again in case sensor was reset
+            self.calibration[address] = None
+            return BME280Reading(None, None, None, address, latency, str(e))
+
+        latency = clock.perf_counter() - start
+        logging.debug("BME280: Read %s in %.04f s", hex(address), latency)
+        return BME280Reading(
+            data.humidity, data.pressure, data.temperature, address, latency, None
+        )
+
+    def read_all(self):
+        return [self.read(address) for address in self.addresses]
+
+
+class temperature_sensor(BME280Sensor):
+    """Previous interface, one sensor at 0x77."""
+
+    def __init__(self):
+        super().__init__(addresses=(0x77,))
+
+    def read_all_bme820(self):
+        reading = self.read()
+        return reading.humidity, reading.pressure, reading.temperature
 
 
 if __name__ == "__main__":
     import time
 
+    bme = BME280Sensor()
     loop_count = 0
 
     while loop_count < 10:
-        bme = temperature_sensor()
-        humidity, pressure, temperature = bme.read_all_bme820()
-
-        print(
-            "Humidy = ",
-            round(humidity, 1),
-            " Pressure = ",
-            round(pressure, 1),
-            "Temp = ",
-            round(temperature, 1),
-        )
+        reading = bme.read()
+
+        if reading.ok:
+            print(
+                "Humidy = ",
+                round(reading.humidity, 1),
+                " Pressure = ",
+                round(reading.pressure, 1),
+                "Temp = ",
+                round(reading.temperature, 1),
+                "Read {:.04f} s".format(reading.latency),
+            )
+        else:
+            print("Read failed:", reading.error)
         time.sleep(0.5)
         loop_count += 1
 
@@ -0,0 +1,129 @@
+import os
+import time
+import errno
+import logging
+
+from errors import ErrorNetworkIssue
+
+"""Append handle kept open between writes, used by the CSV and flat file
+sinks. On the NAS share every open(), close() and os.path.exists() is a
+network round trip, with the handle kept open a drain of queued entries is
+buffered and costs one write.
+
+A handle made stale by the share going away (ESTALE, EIO) is dropped and
+ErrorNetworkIssue raised, the next open() reopens the file. Rows written but
+not yet flushed when that happens are lost from the buffer, DataMgr keeps
+entries in its spool until unflushed drops to 0 and writes them again."""
+
+# errno values of a handle that no longer refers to the file on the share
+STALE_ERRORS = (errno.ESTALE, errno.EIO)
+
+
+class BufferedFile:
+    """
+    file_name: file to append to
+    flush_rows: rows written before end() flushes, 1 flushes every drain
+    flush_interval: seconds, end() flushes if last flush is older
+    fsync: fsync after each flush, so rows survive a crash of the NAS
+    newline: passed to open()
+    """
+
+    def __init__(
+        self, file_name, flush_rows=1, flush_interval=60.0, fsync=False, newline=None
+    ):
+        self.file_name = file_name
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.newline = newline
+
+        self.handle = None
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    """
+    Opens file if not open, returns True if a new handle was opened. An open
+    handle is checked with fstat(), a stale one is replaced.
+    """
+
+    def open(self):
+        if self.handle is not None:
+            try:
+                os.fstat(self.handle.fileno())
+                return False
+            except OSError as e:
+                if e.errno not in STALE_ERRORS:
+                    raise
+                logging.warning("FILE: Stale handle %s, reopening", self.file_name)
+                self._drop()
+
+        try:
+            self.handle = open(self.file_name, "a", newline=self.newline)
+        except OSError as e:
+            logging.warning("FILE: Open %s failed: %s", self.file_name, e)
+            raise ErrorNetworkIssue
+        return True
+
+    # Writes text of rows rows, a stale handle raises ErrorNetworkIssue
+    def write(self, text, rows=1):
+        try:
+            self.handle.write(text)
+        except OSError as e:
+            self.failed(e)
+        self.unflushed += rows
+
+    # Counts rows written to handle by someone else, e.g. csv.writer
+    def wrote(self, rows=1):
+        self.unflushed += rows
+
+    """
+    Called with an OSError raised while using handle. Stale handle is dropped
+    and ErrorNetworkIssue raised, anything else is raised again.
+    """
+
+    def failed(self, e):
+        if e.errno in STALE_ERRORS:
+            logging.warning("FILE: %s on %s, reopening", e, self.file_name)
+            self._drop()
+            raise ErrorNetworkIssue
+        raise e
+
+    # End of a drain, flushes if flush_rows or flush_interval is reached,
+    # or with force
+    def end(self, force=False):
+        if self.handle is None or self.unflushed == 0:
+            return
+        if (
+            force
+            or self.unflushed >= self.flush_rows
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.handle is None:
+            return
+        try:
+            self.handle.flush()
+            if self.fsync:
+                os.fsync(self.handle.fileno())
+        except OSError as e:
+            self.failed(e)
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.handle is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._drop()
+
+    def _drop(self):
+        try:
+            self.handle.close()
+        except OSError:
+            pass
+        self.handle = None
+        self.unflushed = 0
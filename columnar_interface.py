@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import struct
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from errors import ErrorNetworkIssue
+from wind_direction import COMPASS_POINTS, NO_DIRECTION
+
+"""Columnar binary storage. Each record is a fixed width struct: time as
+int64 epoch seconds, wind direction as a uint8 compass point code and every
+other column as float32, with no padding. None is stored as NaN, or 255 for
+direction.
+
+The file starts with MAGIC, a uint32 header length and a json header giving
+the name and NumPy type of each column, padded so records start on an
+8 byte boundary. load() maps the records into a NumPy structured array
+without reading or copying them, data["temp"] is a view of one column."""
+
+MAGIC = b"WSCOLUMN"
+VERSION = 1
+HEADER_ALIGN = 8
+
+TIME_COLUMNS = ("time",)
+DIRECTION_COLUMNS = ("w_dir",)
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# NumPy type to struct format, little endian
+STRUCT_FORMATS = {"<i8": "q", "<u1": "B", "<f4": "f"}
+
+
+# Record time to epoch seconds, strings are local time as the station writes
+def epoch_seconds(value):
+    if isinstance(value, str):
+        return int(time.mktime(time.strptime(value, TIME_FORMAT)))
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def column_type(name):
+    if name in TIME_COLUMNS:
+        return "<i8"
+    if name in DIRECTION_COLUMNS:
+        return "<u1"
+    return "<f4"
+
+
+# Packs the header, padded with spaces so records are aligned
+def pack_header(columns):
+    header = json.dumps({"version": VERSION, "columns": columns}).encode()
+    size = len(MAGIC) + 4 + len(header)
+    header += b" " * (-size % HEADER_ALIGN)
+    return MAGIC + struct.pack("<I", len(header)) + header
+
+
+"""
+Returns (columns, size) of the header of an open binary file, columns is a
+list of [name, NumPy type] and size the offset of the first record.
+"""
+
+
+def read_header(file_handle):
+    magic = file_handle.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a columnar weather station file")
+    (length,) = struct.unpack("<I", file_handle.read(4))
+    header = json.loads(file_handle.read(length))
+    if header["version"] != VERSION:
+        raise ValueError("Unsupported version {}".format(header["version"]))
+    return header["columns"], len(MAGIC) + 4 + length
+
+
+"""
+Maps the records of file_name into a read only NumPy structured array,
+the file is not read until a column is used.
+"""
+
+
+def load(file_name):
+    with open(file_name, "rb") as f:
+        columns, offset = read_header(f)
+    dtype = np.dtype([(name, kind) for name, kind in columns])
+    records = (os.path.getsize(file_name) - offset) // dtype.itemsize
+    if records == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode="r", offset=offset, shape=(records,))
+
+
+class ColumnarDatabase:
+    """
+    column_names: record columns, see column_type() for how each is stored
+    columnar_config: file name
+    """
+
+    def __init__(self, column_names, columnar_config):
+        self.field_names = column_names
+        self.columnar_file_name = columnar_config
+        self.file_handle = None
+
+        self.columns = [[name, column_type(name)] for name in self.field_names]
+        self.record = struct.Struct(
+            "<" + "".join(STRUCT_FORMATS[kind] for _, kind in self.columns)
+        )
+        self.directions = {point: code for code, point in enumerate(COMPASS_POINTS)}
+
+        # Check if file exists
+        if os.path.exists(self.columnar_file_name):
+
+            # If exists, the check if header matches column_names
+            with open(self.columnar_file_name, "r+b") as self.file_handle:
+                columns, offset = read_header(self.file_handle)
+                if columns != self.columns:
+                    logging.error("COLUMNAR: Columns do NOT match %s", columns)
+                    exit(1)
+
+                self.offset = offset
+                self._trim()
+
+        # File does not exist, create file and write header
+        else:
+            with open(self.columnar_file_name, "ab") as self.file_handle:
+                header = pack_header(self.columns)
+                self.file_handle.write(header)
+                self.offset = len(header)
+
+    # A record cut short by a power cut, lost share or failed write is
+    # dropped, so the next record starts on a record boundary
+    def _trim(self):
+        fileno = self.file_handle.fileno()
+        size = os.fstat(fileno).st_size
+        whole = self.offset + (size - self.offset) // self.record.size * self.record.size
+        if whole != size:
+            logging.warning("COLUMNAR: Truncating partial record")
+            os.ftruncate(fileno, whole)
+
+    """
+    Opens DB connection and connects cursor. In the event of a network issue,
+    a ErrorNetworkIssue is thrown.
+    """
+
+    def open_db(self):
+        try:
+            self.file_handle = open(self.columnar_file_name, "ab")
+            self._trim()
+        except OSError as e:
+            logging.warning("COLUMNAR: Open failed: %s", e)
+            raise ErrorNetworkIssue
+
+    # Converts one value to the type of its column
+    def _value(self, kind, value):
+        if kind == "<i8":
+            return epoch_seconds(value)
+        if kind == "<u1":
+            return self.directions.get(value, NO_DIRECTION)
+        return float("nan") if value is None else float(value)
+
+    def pack(self, entry):
+        return self.record.pack(
+            *(self._value(kind, value) for (_, kind), value in zip(self.columns, entry))
+        )
+
+    """
+    send_data requires connection to DB before calling this function.
+    Also, routine does not close connection.
+    With multi_entry, entry is a list of entries written with one write().
+    """
+
+    def send_data(self, entry, multi_entry=False):
+        entries = entry if multi_entry else [entry]
+        data = b"".join(self.pack(params) for params in entries)
+        try:
+            self.file_handle.write(data)
+            self.file_handle.flush()
+        except OSError as e:
+            logging.warning("COLUMNAR: Write failed: %s", e)
+            raise ErrorNetworkIssue
+
+    # Every send_data() is flushed
+    def unflushed(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    # Closes cursor and connection, after a failed write closing may fail
+    # too, open_db() trims what was written
+    def close_db(self, flush=False):
+        try:
+            self.file_handle.close()
+        except OSError as e:
+            logging.warning("COLUMNAR: Close failed: %s", e)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Summary of a columnar file, e.g. python3 columnar_interface.py data.bin
+    data = load(sys.argv[1])
+    print("{} records".format(len(data)))
+    for name in data.dtype.names:
+        column = data[name]
+        if name in TIME_COLUMNS:
+            if len(column):
+                print(
+                    "{}: {} to {}".format(
+                        name,
+                        datetime.fromtimestamp(int(column[0])),
+                        datetime.fromtimestamp(int(column[-1])),
+                    )
+                )
+        elif name in DIRECTION_COLUMNS:
+            counts = np.bincount(column[column != NO_DIRECTION], minlength=16)
+            print("{}: most common {}".format(name, COMPASS_POINTS[int(counts.argmax())]))
+        else:
+            print("{}: mean {:.2f}".format(name, float(np.nanmean(column))))
@@ -3,11 +3,17 @@ import logging
 import csv
 
 from errors import ErrorNetworkIssue
+from buffered_file import BufferedFile
 
 class CsvDatabase:
-    """ """
+    """
+    File is kept open between writes, see buffered_file.py for
+    flush_rows, flush_interval and fsync.
+    """
 
-    def __init__(self, column_names, csv_config):
+    def __init__(
+        self, column_names, csv_config, flush_rows=1, flush_interval=60.0, fsync=False
+    ):
 
         self.field_names = column_names
         self.csv_file_name = csv_config
@@ -52,6 +58,10 @@ class CsvDatabase:
                 self.csv_writer = csv.writer(self.file_handle, lineterminator=self.eol)
                 self.csv_writer.writerow(self.field_names)
 
+        self.file = BufferedFile(
+            self.csv_file_name, flush_rows, flush_interval, fsync, newline=""
+        )
+
     """
     Opens DB connection and connects cursor. In the event of a network issue,
     a ErrorNetworkIssue is thrown.
@@ -59,8 +69,9 @@ class CsvDatabase:
 
     def open_db(self):
         # try:
-        self.file_handle = open(self.csv_file_name, "a", newline="")
-        self.csv_writer = csv.writer(self.file_handle, lineterminator=self.eol)
+        if self.file.open():
+            self.file_handle = self.file.handle
+            self.csv_writer = csv.writer(self.file_handle, lineterminator=self.eol)
 
         # ToDo Need to determine what to do if can disk cannot be written
         # except (
@@ -93,7 +104,11 @@ class CsvDatabase:
         #     if multi_entry:
         #         self.csv_writer.writerow(entry)
         #     else:
-        self.csv_writer.writerow(entry)
+        try:
+            self.csv_writer.writerow(entry)
+        except OSError as e:
+            self.file.failed(e)
+        self.file.wrote()
 
         # except (mysql.connector.OperationalError, mysql.connector.InterfaceError) as e:
         #     logging.debug(f"Warming Exception in write_one_db() Operational Error: {e}")
@@ -103,9 +118,22 @@ class CsvDatabase:
         # except Exception as e:
         #      raise e
 
-    # Closes cursor and connection
-    def close_db(self):
-        self.file_handle.close()
+    # Rows written but not yet flushed to the file
+    def unflushed(self):
+        return self.file.unflushed
+
+    # Flushes rows written, whatever the flush policy
+    def flush(self):
+        self.file.flush()
+
+    # End of a drain, file stays open and is flushed per flush policy, or
+    # now with flush
+    def close_db(self, flush=False):
+        self.file.end(flush)
+
+    # Flushes and closes file, call before program exits
+    def close(self):
+        self.file.close()
 
 
 if __name__ == "__main__":
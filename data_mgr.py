@@ -1,19 +1,44 @@
 from db_interface import MariaDatabase
 
 # from db_interface import MariaDatabase, ErrorNetworkIssue
-import logging
 import os
-import subprocess
+import logging
+import time
+import queue
+import asyncio
+import threading
 import flat_interface
 import csv_interface
+import columnar_interface
+import spool
+import sqlite_staging
+from nas_health import MountHealth, BoundedCall
 
 from errors import ErrorNetworkIssue
 
 """Data Manager is responsible for storing data to a database or
-optionally in a json or CSV flat file format.
+optionally in a json or CSV flat file format, a columnar binary file
+(see columnar_interface.py) or a date partitioned Parquet dataset
+(see parquet_interface.py, needs pyarrow).
 APP assumes data is always stored to a mariadb, but can be disabled
 using mariadb=False."""
 
+# Sinks written to the NAS, each write is bounded by file_timeout
+FILE_SINKS = ("flat", "csv", "columnar", "parquet")
+
+# Spool used by file sinks when neither spool_config nor staging_config is
+# set, kept in the directory of the log file. spool_config=None keeps the
+# spool in memory
+DEFAULT_SPOOL = "weather_station.spool"
+
+
+# Directory of the first log file of the root logger, None if there is none
+def _log_directory():
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return os.path.dirname(handler.baseFilename)
+    return None
+
 
 class DataMgr:
     def __init__(self, column_names, mariadb=True, **kwargs):
@@ -25,26 +50,91 @@ class DataMgr:
         self.db_config = None
         self.flat_config = None
         self.csv_config = None
+        self.columnar_config = None
+        self.parquet_config = None
+        # SQLite file used in place of MariaDB for simulation and benchmarks
+        self.sim_db = None
 
         # Local variables
         self.db_enabled = False
         self.flat_enabled = False
         self.csv_enabled = False
+        self.columnar_enabled = False
+        self.parquet_enabled = False
 
         # class variables
         self.data_mgr_db = None
         self.data_mgr_csv = None
         self.data_mgr_flat = None
+        self.data_mgr_columnar = None
+        self.data_mgr_parquet = None
 
         # data_entries is designed to be elastic store for sensor data.
         # Build as a FIFO, occupancy will only be greather than one if
         # a network problem is preventing data updates to MariaDB
-        self.data_entries_db = []
-        self.data_entries_flat = []
-        self.data_entries_csv = []
+        # Each is a cursor into spool_entries, see spool.py
+        self.spool_entries = None
+        self.data_entries_db = None
+        self.data_entries_flat = None
+        self.data_entries_csv = None
+        self.data_entries_columnar = None
+        self.data_entries_parquet = None
 
         self.data_file_flat = None
         self.data_file_csv = None
+        self.data_file_columnar = None
+        # Parquet dataset directory
+        self.data_dir_parquet = None
+        # Optional spool file, keeps FIFO on disk over restarts and outages
+        self.data_file_spool = None
+        self.memory_spool = False
+        # Optional SQLite staging database, used as the FIFO in place of the
+        # spool file. MariaDB is then written by the replicator thread, see
+        # sqlite_staging.py
+        self.data_file_staging = None
+        self.replicate_interval = 60.0
+        self.replicator_thread = None
+        self.replicate_event = threading.Event()
+        self.replicator_stop = False
+
+        # Maximum entries read from the FIFO at once when draining to files
+        self.file_batch_size = 500
+
+        # CSV and flat files are kept open, flushed when a drain ends and
+        # file_flush_rows rows or file_flush_interval seconds have passed,
+        # see buffered_file.py
+        self.file_flush_rows = 1
+        self.file_flush_interval = 60.0
+        self.file_fsync = False
+        # File sink paths are checked in a worker process, which gives up
+        # after nas_timeout seconds, result is kept nas_ttl seconds.
+        # See nas_health.py
+        self.nas_timeout = 2.0
+        self.nas_ttl = 30.0
+        self.nas_health = {}
+        # Seconds the caller waits for a file sink write, a write still
+        # running after that is left behind and the sink skipped until done
+        self.file_timeout = 30.0
+        self.file_calls = {}
+
+        # Flat file rows encoded with orjson, if installed
+        self.flat_orjson = False
+
+        # Optional writer thread, update_entries() spools the entry and wakes
+        # the thread, which writes the spool to the sinks
+        self.async_writer = False
+        self.queue_size = 100
+        self.entry_queue = None
+        self.writer_thread = None
+        self.writer_stop = False
+        self.writer_error = None
+
+        # Seconds taken by last write to each sink
+        self.sink_latency = {}
+
+        # Number of queued entries sent to MariaDB per executemany()/commit()
+        # when draining a backlog, 1 writes entries one at a time
+        self.db_batch_size = 50
 
         # valid KWARGS, '_config' values should be filenames
         # 'mariadb' = False to disable MariaDB usage
@@ -59,6 +149,41 @@ class DataMgr:
                 self.data_file_flat = value.strip()
             if key == "csv_config":
                 self.data_file_csv = value.strip()
+            if key == "columnar_config":
+                self.data_file_columnar = value.strip()
+            if key == "parquet_config":
+                self.data_dir_parquet = value.strip()
+            if key == "sim_db":
+                self.sim_db = value.strip()
+            if key == "spool_config":
+                if value is None or value == "None":
+                    self.memory_spool = True
+                else:
+                    self.data_file_spool = value.strip()
+            if key == "staging_config":
+                self.data_file_staging = value.strip()
+            if key == "replicate_interval":
+                self.replicate_interval = float(value)
+            if key == "db_batch_size":
+                self.db_batch_size = max(1, int(value))
+            if key == "async_writer":
+                self.async_writer = value == True or value == "True"
+            if key == "queue_size":
+                self.queue_size = max(1, int(value))
+            if key == "file_flush_rows":
+                self.file_flush_rows = max(1, int(value))
+            if key == "file_flush_interval":
+                self.file_flush_interval = float(value)
+            if key == "file_fsync":
+                self.file_fsync = value == True or value == "True"
+            if key == "nas_timeout":
+                self.nas_timeout = float(value)
+            if key == "nas_ttl":
+                self.nas_ttl = float(value)
+            if key == "file_timeout":
+                self.file_timeout = float(value)
+            if key == "flat_orjson":
+                self.flat_orjson = value == True or value == "True"
 
         # Initialize db and then try to open. open_db() function returns True if connected.
         # This is initial check of the db connection.
@@ -66,7 +191,14 @@ class DataMgr:
         if self.mariadb:
             try:
                 logging.info("MGR-DB: Initial Connection to Database")
-                self.data_mgr_db = MariaDatabase(self.column_names, self.db_config)
+                if self.sim_db:
+                    import sim_hardware
+
+                    self.data_mgr_db = sim_hardware.SimMariaDatabase(
+                        self.column_names, self.sim_db
+                    )
+                else:
+                    self.data_mgr_db = MariaDatabase(self.column_names, self.db_config)
                 self.data_mgr_db.open_db()
                 self.db_enabled = self.data_mgr_db.is_connected_db()
                 self.data_mgr_db.close_db()
@@ -79,16 +211,106 @@ class DataMgr:
 
         if self.data_file_flat:
             self.data_mgr_flat = flat_interface.FlatDatabase(
-                self.column_names, self.data_file_flat
+                self.column_names,
+                self.data_file_flat,
+                self.file_flush_rows,
+                self.file_flush_interval,
+                self.file_fsync,
+                self.flat_orjson,
             )
             self.flat_enabled = True
 
         if self.data_file_csv:
             self.data_mgr_csv = csv_interface.CsvDatabase(
-                column_names, self.data_file_csv
+                column_names,
+                self.data_file_csv,
+                self.file_flush_rows,
+                self.file_flush_interval,
+                self.file_fsync,
             )
             self.csv_enabled = True
 
+        if self.data_file_columnar:
+            self.data_mgr_columnar = columnar_interface.ColumnarDatabase(
+                self.column_names, self.data_file_columnar
+            )
+            self.columnar_enabled = True
+
+        if self.data_dir_parquet:
+            # pyarrow is only needed when Parquet is used
+            import parquet_interface
+
+            self.data_mgr_parquet = parquet_interface.ParquetDatabase(
+                self.column_names, self.data_dir_parquet
+            )
+            self.parquet_enabled = True
+
+        # FIFO shared by all enabled sinks, each sink drains at its own pace.
+        # An existing spool file is replayed, queued entries are sent with
+        # the next update.
+        sinks = []
+        if self.db_enabled:
+            sinks.append("db")
+        if self.flat_enabled:
+            sinks.append("flat")
+        if self.csv_enabled:
+            sinks.append("csv")
+        if self.columnar_enabled:
+            sinks.append("columnar")
+        if self.parquet_enabled:
+            sinks.append("parquet")
+
+        # Entries of file sinks wait on local disk while the NAS is down
+        if (
+            not self.data_file_staging
+            and not self.data_file_spool
+            and not self.memory_spool
+            and any(sink in FILE_SINKS for sink in sinks)
+        ):
+            directory = _log_directory()
+            if directory:
+                self.data_file_spool = os.path.join(directory, DEFAULT_SPOOL)
+            else:
+                logging.warning("MGR: No log file, set spool_config to spool on disk")
+
+        if self.data_file_staging:
+            logging.info("MGR: Staging database %s", self.data_file_staging)
+            self.spool_entries = sqlite_staging.SqliteStaging(
+                self.data_file_staging, self.column_names, sinks
+            )
+        elif self.data_file_spool:
+            logging.info("MGR: Spool file %s", self.data_file_spool)
+            self.spool_entries = spool.SpoolFile(self.data_file_spool, sinks)
+        else:
+            self.spool_entries = spool.MemorySpool(sinks)
+
+        if self.db_enabled:
+            self.data_entries_db = self.spool_entries.cursor("db")
+        if self.flat_enabled:
+            self.data_entries_flat = self.spool_entries.cursor("flat")
+        if self.csv_enabled:
+            self.data_entries_csv = self.spool_entries.cursor("csv")
+        if self.columnar_enabled:
+            self.data_entries_columnar = self.spool_entries.cursor("columnar")
+        if self.parquet_enabled:
+            self.data_entries_parquet = self.spool_entries.cursor("parquet")
+
+        # Records staged locally are replicated to MariaDB off the
+        # sampling path, queued records are sent at start up
+        if self.data_file_staging and self.db_enabled:
+            self.replicator_thread = threading.Thread(
+                target=self._replicator, name="Replicator", daemon=True
+            )
+            self.replicator_thread.start()
+            self.replicate_event.set()
+
+        if self.async_writer:
+            self.entry_queue = queue.Queue(self.queue_size)
+            self.writer_thread = threading.Thread(
+                target=self._writer, name="DataMgrWriter", daemon=True
+            )
+            self.writer_thread.start()
+
     """update_entries takes a tuple of data as params.
     A ErrorNetworkIssue is thrown if entry cannot be written to DB, user must
     manage errors."""
@@ -124,46 +346,266 @@ class DataMgr:
             # Close upon exit
             self.data_mgr_db.close_db()
 
+    """update_entries takes a tuple of data as params.
+    With async_writer the entry is appended to the spool by the caller, so
+    it is as durable as without the writer thread, and the writer thread is
+    woken to write it to the sinks. The call never waits for a sink. An error
+    that stopped the writer or replicator thread is raised by the next call."""
+
     def update_entries(self, params):
-        if self.db_enabled:
-            self._send2db(params)
+        if self.writer_error is not None:
+            raise self.writer_error
 
-        if self.flat_enabled:
-            self._send2flat(params)
+        if not self.async_writer:
+            self._write_entries([params])
+            return
 
+        self._spool([params])
+        try:
+            self.entry_queue.put_nowait(True)
+        except queue.Full:
+            # Writer has wake ups pending, it writes everything spooled
+            logging.warning("MGR: Writer behind, %s entries queued", self.queue_depth())
+
+    """update_entries_async is update_entries() for an asyncio event loop.
+    The entry is spooled, then every enabled sink is written in its own
+    worker thread at the same time, so a slow sink does not hold up the
+    others or the loop. With async_writer the entry goes to the writer
+    thread as usual."""
+
+    async def update_entries_async(self, params):
+        if self.async_writer:
+            self.update_entries(params)
+            return
+
+        self._spool([params])
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(self._timed_send, sink, send)
+                for sink, send in self._sink_sends()
+            )
+        )
+
+    def _write_entries(self, entries):
+        self._spool(entries)
+        self._send_sinks()
+
+    def _send_sinks(self):
+        for sink, send in self._sink_sends():
+            self._timed_send(sink, send)
+
+    def _spool(self, entries):
+        # push data into FIFO once, each sink reads it through its cursor
+        for params in entries:
+            self.spool_entries.append(params)
+
+        if self.replicator_thread:
+            self.replicate_event.set()
+
+    # (name, send function) of each enabled sink written by the caller,
+    # in write order
+    def _sink_sends(self):
+        sends = []
+        if self.db_enabled and not self.replicator_thread:
+            sends.append(("db", self._send2db))
+        if self.flat_enabled:
+            sends.append(("flat", self._send2flat))
         if self.csv_enabled:
-            self._send2csv(params)
+            sends.append(("csv", self._send2csv))
+        if self.columnar_enabled:
+            sends.append(("columnar", self._send2columnar))
+        if self.parquet_enabled:
+            sends.append(("parquet", self._send2parquet))
+        return sends
+
+    def _timed_send(self, sink, send):
+        start = time.monotonic()
+        if sink in FILE_SINKS:
+            self._bounded_send(sink, send)
+        else:
+            send()
+        self.sink_latency[sink] = time.monotonic() - start
+        logging.debug("MGR: %s write %.03f s", sink, self.sink_latency[sink])
+
+    """_bounded_send runs send in a BoundedCall and waits at most
+    file_timeout seconds. A send still blocked on the NAS is left running,
+    the sink is skipped until it returns and its entries stay queued. An
+    error raised by a send after the caller stopped waiting is raised by
+    the next call."""
+
+    def _bounded_send(self, sink, send):
+        call = self.file_calls.get(sink)
+        if call is not None:
+            if not call.done():
+                logging.warning("NAS: %s write still blocked, entries queued", sink)
+                return
+            del self.file_calls[sink]
+            call.check()
+
+        call = BoundedCall(send, "MGR-" + sink)
+        if call.wait(self.file_timeout):
+            call.check()
+            return
+        logging.warning(
+            "NAS: %s write did not finish in %.01f s", sink, self.file_timeout
+        )
+        self.file_calls[sink] = call
+
+    # Writer thread, entries spooled while a write is running go out together
+    def _writer(self):
+        while True:
+            wake_ups = [self.entry_queue.get()]
+            while not self.entry_queue.empty():
+                wake_ups.append(self.entry_queue.get_nowait())
+
+            # close() sets writer_stop and queues None to stop the thread, the
+            # write after either sees every entry spooled before close()
+            queued = len(wake_ups)
+            stop = None in wake_ups or self.writer_stop
 
-    """update_entries takes a tuple of data as params.
-    An FIFO is created containing tuples of data. In the event
-    the DB command cannot be executed the data is queued and
+            try:
+                self._send_sinks()
+            except Exception as e:
+                logging.error("MGR: Writer thread stopped: %s", e)
+                self.writer_error = e
+                stop = True
+            finally:
+                for _ in range(queued):
+                    self.entry_queue.task_done()
+
+            if stop:
+                return
+
+    """Replicator thread, sends staged records to MariaDB when a record is
+    added, and every replicate_interval seconds while MariaDB is not
+    reachable. Records are sent in chunks of db_batch_size."""
+
+    def _replicator(self):
+        while True:
+            self.replicate_event.wait(self.replicate_interval)
+            self.replicate_event.clear()
+            stop = self.replicator_stop
+
+            try:
+                self._timed_send("db", self._send2db)
+            except Exception as e:
+                logging.error("MGR: Replicator thread stopped: %s", e)
+                self.writer_error = e
+                return
+
+            if stop:
+                return
+
+    # Number of spooled entries not yet written by the slowest sink of the
+    # writer thread
+    def queue_depth(self):
+        if not self.entry_queue:
+            return 0
+        cursors = {
+            "db": self.data_entries_db,
+            "flat": self.data_entries_flat,
+            "csv": self.data_entries_csv,
+            "columnar": self.data_entries_columnar,
+            "parquet": self.data_entries_parquet,
+        }
+        return max((len(cursors[sink]) for sink, _ in self._sink_sends()), default=0)
+
+    """close() writes entries still waiting for the writer thread, the
+    replicator thread and the Parquet sink, flushes and closes the CSV and flat files, flushes the
+    spool file to disk and closes pooled DB connections. Call before
+    program exits. Each thread is given timeout seconds to finish, files,
+    spool and pool still in use by a thread that did not finish are left
+    open, its entries stay in the spool file."""
+
+    def close(self, timeout=None):
+        writer_running = False
+        replicator_running = False
+        if self.writer_thread and self.writer_thread.is_alive():
+            self.writer_stop = True
+            try:
+                # A full queue already wakes the writer, it then sees writer_stop
+                self.entry_queue.put_nowait(None)
+            except queue.Full:
+                pass
+            self.writer_thread.join(timeout)
+            if self.writer_thread.is_alive():
+                logging.warning(
+                    "MGR: Writer did not finish, %s entries left", self.queue_depth()
+                )
+                writer_running = True
+        if self.replicator_thread and self.replicator_thread.is_alive():
+            self.replicator_stop = True
+            self.replicate_event.set()
+            self.replicator_thread.join(timeout)
+            if self.replicator_thread.is_alive():
+                logging.warning("MGR: Replicator did not finish")
+                replicator_running = True
+
+        if not writer_running:
+            if self.parquet_enabled:
+                self._bounded_send("parquet", lambda: self._send2parquet(flush=True))
+            # Buffered rows are flushed and removed from the FIFO before the
+            # files are closed, or they would be written again after a restart
+            if self.flat_enabled:
+                self._bounded_send(
+                    "flat", lambda: self._close_file(self._send2flat, self.data_mgr_flat)
+                )
+            if self.csv_enabled:
+                self._bounded_send(
+                    "csv", lambda: self._close_file(self._send2csv, self.data_mgr_csv)
+                )
+
+        if writer_running or replicator_running:
+            # Closing them would fail the thread mid write
+            logging.warning("MGR: Spool and DB connections left open")
+            self.spool_entries.sync()
+            return
+        self.spool_entries.close()
+        if self.data_mgr_db:
+            self.data_mgr_db.close_pool()
+
+    def _close_file(self, send, data_mgr_file):
+        send(flush=True)
+        try:
+            data_mgr_file.close()
+        except ErrorNetworkIssue:
+            logging.warning("MGR: File not flushed, network issue")
+
+    """_send2db drains the DB cursor of the FIFO. In the event
+    the DB command cannot be executed the data stays queued and is
     executed during next/future updates.
+    Queued data is sent in chunks of db_batch_size entries, each chunk is one
+    executemany() and one commit. A failed chunk is rolled back and stays at
+    the top of the FIFO.
     Network errors are managed by this routine and will not stop execution of main."""
 
-    def _send2db(self, params):
-        data_entry = ()
-        # push data into FIFO
-        self.data_entries_db.append(params)
-
+    def _send2db(self):
         # See if DB can be re-opened, Allow Network Issue to pass
         try:
             self.data_mgr_db.open_db()
 
             # May need to enhance worning in future, e.g. send email.
-            if len(self.data_entries_db) > 1:
-                logging.warn("MRG: Data Entries Queued = %s", len(self.data_entries_db))
+            queued = len(self.data_entries_db)
+            if queued > 1:
+                logging.warn("MRG: Data Entries Queued = %s", queued)
 
+            sent = 0
+            drain_start = time.monotonic()
             try:
                 while len(self.data_entries_db) > 0:
-                    # pop FIFO to get oldest data and write to DB
-                    data_entry = self.data_entries_db.pop(0)
-                    logging.info("MGR: Update Entry")
-                    self.data_mgr_db.send_data(data_entry)
+                    # oldest chunk of FIFO is removed only after it is committed
+                    chunk = self.data_entries_db.peek(self.db_batch_size)
+                    logging.info("MGR: Update Entries = %s", len(chunk))
+                    if len(chunk) == 1:
+                        self.data_mgr_db.send_data(chunk[0])
+                    else:
+                        self.data_mgr_db.send_data(chunk, multi_entry=True)
+                    self.data_entries_db.advance(len(chunk))
+                    sent += len(chunk)
 
             except (ErrorNetworkIssue):
-                # If network is problem, Push entry back into top of FIFO
-                # Next update will contain multiple entries
-                self.data_entries_db.insert(0, data_entry)
+                # If network is problem, chunk was rolled back and is still
+                # at top of FIFO. Next update will contain multiple entries
                 logging.info("Network Issue, data entry not updated")
                 pass
 
@@ -176,6 +618,16 @@ class DataMgr:
                 # Close after writing all entries
                 self.data_mgr_db.close_db()
 
+                if queued > 1:
+                    elapsed = time.monotonic() - drain_start
+                    logging.info(
+                        "MGR: Drained %s of %s entries in %.03f s (%.01f rows/s)",
+                        sent,
+                        queued,
+                        elapsed,
+                        sent / elapsed if elapsed > 0 else 0.0,
+                    )
+
         except ErrorNetworkIssue as e:
             # Keep processing data if network goes down
             self.data_mgr_db.close_db()
@@ -186,105 +638,178 @@ class DataMgr:
             self.data_mgr_db.close_db()
             raise
 
-    def _send2flat(self, params):
-        data_entry = ()
-        # push data into FIFO
-        self.data_entries_flat.append(params)
+    """_reachable returns False if path is missing or its share does not
+    answer, without blocking on a hung share. Entries of a sink that is not
+    reachable stay queued."""
+
+    def _reachable(self, path):
+        if path not in self.nas_health:
+            self.nas_health[path] = MountHealth(path, self.nas_timeout, self.nas_ttl)
+        return self.nas_health[path].is_up()
 
+    def _send2flat(self, flush=False):
         # See if DB can be re-opened, Allow Network Issue to pass
         try:
-            # subprocess.check_call(["timeout", 4, "ls", self.data_file_flat])
-            if not os.path.exists(self.data_file_flat):
+            if not self._reachable(self.data_file_flat):
                 raise ErrorNetworkIssue
 
             # May need to enhance worning in future, e.g. send email.
-            if len(self.data_entries_flat) > 1:
+            # Rows in the file buffer are written, only waiting for a flush
+            if len(self.data_entries_flat) - self.data_mgr_flat.unflushed() > 1:
                 logging.warn(
                     "MRG-FLAT: Data Entries Queued = %s", len(self.data_entries_flat)
                 )
 
-            try:
-                self.data_mgr_flat.open_db()
+            self._send2file(
+                "MGR-FLAT",
+                self.data_mgr_flat,
+                self.data_entries_flat,
+                multi_entry=True,
+                flush=flush,
+            )
+
+        except ErrorNetworkIssue as e:
+            # Keep processing data if network goes down
+            pass
 
-                while len(self.data_entries_flat) > 0:
-                    # pop FIFO to get oldest data and write to DB
-                    data_entry = self.data_entries_flat.pop(0)
-                    logging.info("MGR-FLAT: Update Entry")
-                    self.data_mgr_flat.send_data(data_entry)
+        except Exception as e:
+            # Non-Network error, will stop execution of main
+            raise
 
-            except (ErrorNetworkIssue):
-                # If network is problem, Push entry back into top of FIFO
-                # Next update will contain multiple entries
-                self.data_entries_flat.insert(0, data_entry)
-                logging.info("Network Issue, data entry not updated")
-                logging.warn("Network Issue, data entry not updated")
-                pass
+    def _send2csv(self, flush=False):
+        # See if DB can be re-opened, Allow Network Issue to pass
+        try:
+            if not self._reachable(self.data_file_csv):
+                raise ErrorNetworkIssue
 
-            except Exception as e:
-                # Other error, stop execution of program
-                logging.error("update entry(), data entry not updated: %s", e)
-                raise
+            # May need to enhance worning in future, e.g. send email.
+            # Rows in the file buffer are written, only waiting for a flush
+            if len(self.data_entries_csv) - self.data_mgr_csv.unflushed() > 1:
+                logging.warn(
+                    "MRG-CSV: Data Entries Queued = %s", len(self.data_entries_csv)
+                )
 
-            finally:
-                # Close after writing all entries
-                self.data_mgr_flat.close_db()
+            self._send2file(
+                "MGR-CSV", self.data_mgr_csv, self.data_entries_csv, flush=flush
+            )
 
         except ErrorNetworkIssue as e:
+            # Keep processing data if network goes down
             pass
-        # except subprocess.CalledProcessError:
-        #     # Keep processing data if network goes down
-        #     raise ErrorNetworkIssue
 
         except Exception as e:
             # Non-Network error, will stop execution of main
             raise
 
-    def _send2csv(self, params):
-        data_entry = ()
-        # push data into FIFO
-        self.data_entries_csv.append(params)
-
+    def _send2columnar(self, flush=False):
         # See if DB can be re-opened, Allow Network Issue to pass
         try:
-            if not os.path.exists(self.data_file_csv):
+            if not self._reachable(self.data_file_columnar):
                 raise ErrorNetworkIssue
 
             # May need to enhance worning in future, e.g. send email.
-            if len(self.data_entries_csv) > 1:
+            # Rows in the file buffer are written, only waiting for a flush
+            if len(self.data_entries_columnar) - self.data_mgr_columnar.unflushed() > 1:
                 logging.warn(
-                    "MRG-FLAT: Data Entries Queued = %s", len(self.data_entries_csv)
+                    "MRG-COLUMNAR: Data Entries Queued = %s",
+                    len(self.data_entries_columnar),
                 )
 
-            try:
-                self.data_mgr_csv.open_db()
+            self._send2file(
+                "MGR-COLUMNAR",
+                self.data_mgr_columnar,
+                self.data_entries_columnar,
+                multi_entry=True,
+                flush=flush,
+            )
+
+        except ErrorNetworkIssue as e:
+            # Keep processing data if network goes down
+            pass
 
-                while len(self.data_entries_csv) > 0:
-                    # pop FIFO to get oldest data and write to DB
-                    data_entry = self.data_entries_csv.pop(0)
-                    logging.info("MGR-CSV: Update Entry")
-                    self.data_mgr_csv.send_data(data_entry)
+        except Exception as e:
+            # Non-Network error, will stop execution of main
+            raise
 
-            except (ErrorNetworkIssue):
-                # If network is problem, Push entry back into top of FIFO
-                # Next update will contain multiple entries
-                self.data_entries_csv.insert(0, data_entry)
-                logging.info("Network Issue, data entry not updated")
-                logging.warn("Network Issue, data entry not updated")
-                pass
+    """_send2parquet writes the queued entries of each complete UTC day, or
+    row_group_size entries, as one Parquet file. Entries stay in the FIFO
+    until written, with a spool file they survive a restart. flush writes
+    the entries of an incomplete day too."""
 
-            except Exception as e:
-                # Other error, stop execution of program
-                logging.error("update entry(), data entry not updated: %s", e)
-                raise
+    def _send2parquet(self, flush=False):
+        try:
+            if not self._reachable(self.data_dir_parquet):
+                raise ErrorNetworkIssue
+            self.data_mgr_parquet.open_db()
 
-            finally:
-                # Close after writing all entries
-                self.data_mgr_csv.close_db()
+            while len(self.data_entries_parquet) > 0:
+                chunk = self.data_entries_parquet.peek(
+                    self.data_mgr_parquet.row_group_size
+                )
+                count = self.data_mgr_parquet.ready(chunk, flush)
+                if count == 0:
+                    break
+                logging.info("MGR-PARQUET: Update Entries = %s", count)
+                self.data_mgr_parquet.send_data(chunk[:count], multi_entry=True)
+                self.data_entries_parquet.advance(count)
 
         except ErrorNetworkIssue as e:
-            # Keep processing data if network goes down
+            # Keep processing data if network goes down, entries stay queued
+            logging.info("Network Issue, data entry not updated")
             pass
 
         except Exception as e:
             # Non-Network error, will stop execution of main
             raise
+
+        finally:
+            self.data_mgr_parquet.close_db()
+
+    """_send2file writes queued entries of a flat, CSV or columnar file.
+    Entries are removed from the FIFO only once they are flushed, rows still
+    in the file buffer are skipped by the next drain. A failed write or
+    flush drops the buffered rows with the handle, they stay queued and are
+    written again by the next drain.
+    With multi_entry each chunk is one send_data() call. flush flushes at
+    the end of the drain whatever the flush policy."""
+
+    def _send2file(self, tag, data_mgr_file, data_entries, multi_entry=False, flush=False):
+        try:
+            data_mgr_file.open_db()
+
+            while True:
+                # read oldest data from FIFO not yet in the file buffer
+                buffered = data_mgr_file.unflushed()
+                chunk = data_entries.peek(buffered + self.file_batch_size)[buffered:]
+                if not chunk:
+                    break
+                if multi_entry:
+                    logging.info("%s: Update Entries = %s", tag, len(chunk))
+                    data_mgr_file.send_data(chunk, multi_entry=True)
+                else:
+                    for data_entry in chunk:
+                        logging.info("%s: Update Entry", tag)
+                        data_mgr_file.send_data(data_entry)
+
+                # A backlog is flushed chunk by chunk
+                written = buffered + len(chunk)
+                if len(data_entries) > written:
+                    data_mgr_file.flush()
+                data_entries.advance(written - data_mgr_file.unflushed())
+
+            # End of drain, flushed per flush policy
+            buffered = data_mgr_file.unflushed()
+            data_mgr_file.close_db(flush)
+            data_entries.advance(buffered - data_mgr_file.unflushed())
+
+        except (ErrorNetworkIssue):
+            # If network is problem, unflushed entries stay on top of FIFO
+            # Next update will contain multiple entries
+            logging.info("Network Issue, data entry not updated")
+            logging.warn("Network Issue, data entry not updated")
+            data_mgr_file.close_db()
+
+        except Exception as e:
+            # Other error, stop execution of program
+            logging.error("update entry(), data entry not updated: %s", e)
+            raise
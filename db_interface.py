@@ -1,10 +1,17 @@
 import os
+import time
 import logging
 import json
 
 import mysql.connector
 
 from errors import ErrorNetworkIssue
+from rollups import Rollups
+from wind_direction import COMPASS_POINTS
+
+# Unknown column and value for a generated column, an insert raced the swap
+# of migrate.py on a pooled connection
+SCHEMA_ERRORS = (1054, 1906)
 
 
 class MariaDatabase:
@@ -28,10 +35,32 @@ class MariaDatabase:
         self.db_name = os.environ.get("WS_DB_NAME", "weather_data")
         self.db_table = os.environ.get("WS_DB_TABLE", "sensors")
 
+        # Connection pool settings, pool keeps long-lived connections so a
+        # normal write is one round trip instead of connect/auth/cursor/close
+        self.pool_size = int(os.environ.get("WS_POOL_SIZE", 2))
+        self.connect_timeout = int(os.environ.get("WS_CONNECT_TIMEOUT", 5))
+        self.connect_retries = int(os.environ.get("WS_CONNECT_RETRIES", 2))
+        self.retry_delay = float(os.environ.get("WS_RETRY_DELAY", 0.5))
+        # Pooled connections idle longer than this are checked with ping()
+        # before reuse, others are used as is
+        self.pool_idle = float(os.environ.get("WS_POOL_IDLE", 600))
+
+        # Update hourly/daily/monthly rollup tables with each insert,
+        # see rollups.py and SQL/addrollups.sql
+        use_rollups = os.environ.get("WS_ROLLUPS", "False") == "True"
+
         # Class specific variables
         self.connection = None
         self.cursor = None
 
+        # Idle (connection, monotonic time returned) available for reuse by
+        # open_db()
+        self.pool = []
+
+        # Set when a statement fails on the network, the connection is then
+        # closed instead of pooled
+        self.connection_failed = False
+
         # ToDo Need to decide if failed_connections should throw error
         self.failed_connection = 0
 
@@ -53,16 +82,64 @@ class MariaDatabase:
                     self.db_name = value
                 if key == "WS_DB_TABLE":
                     self.db_table = value
+                if key == "WS_POOL_SIZE":
+                    self.pool_size = int(value)
+                if key == "WS_CONNECT_TIMEOUT":
+                    self.connect_timeout = int(value)
+                if key == "WS_CONNECT_RETRIES":
+                    self.connect_retries = int(value)
+                if key == "WS_RETRY_DELAY":
+                    self.retry_delay = float(value)
+                if key == "WS_POOL_IDLE":
+                    self.pool_idle = float(value)
+                if key == "WS_ROLLUPS":
+                    use_rollups = value == "True"
+
+        self.rollups = None
+        if use_rollups:
+            if "time" in self.column_names:
+                self.rollups = Rollups(self.column_names, self.db_table)
+            else:
+                logging.warning("DB-IF: Rollups need a time column, not updated")
+
+        # w_dir is written as w_dir_code, the index of the compass point, to
+        # tables migrated to schema version 2, see migrate.py. The table is
+        # checked on each new connection, see _check_schema()
+        self.dir_index = None
+        self.dir_codes = {point: code for code, point in enumerate(COMPASS_POINTS)}
 
         # Set up Maria DB connection parameters
+        # connect_timeout bounds how long a dead host can block the caller
         self.connection_params = {
             "user": self.username,
             "password": self.password,
             "host": self.host,
             "database": self.db_name,
-            # "connect_timeout": 5,
+            "connect_timeout": self.connect_timeout,
         }
 
+        self._set_write_cmd(False)
+
+        # SQL read commenad is used only for testing this module,
+        # Weather Station only writes to DB
+        self.db_read_cmd = os.environ.get("WS_DB_READ_CMD")
+        if self.db_read_cmd == None:
+            self.db_read_cmd = "SELECT * FROM {0} ORDER BY id DESC LIMIT 5".format(
+                self.db_table
+            )
+
+    """
+    Builds the INSERT command, with w_dir_code in place of w_dir when
+    use_dir_code is True.
+    """
+
+    def _set_write_cmd(self, use_dir_code):
+        insert_names = list(self.column_names)
+        self.dir_index = None
+        if use_dir_code and "w_dir" in self.column_names:
+            self.dir_index = self.column_names.index("w_dir")
+            insert_names[self.dir_index] = "w_dir_code"
+
         # SQL command portion of DB write
         # if column_names list = [var1, var2] and table_name = sensors then
         # column_names_str = 'var1, var2' and
@@ -70,7 +147,7 @@ class MariaDatabase:
         # self.db_write_cmd = 'INSERT INTO sensors VALUES (var1, var2) (%s, %s)
 
         table_name_str = self.db_table
-        column_names_str = ", ".join(self.column_names)
+        column_names_str = ", ".join(insert_names)
         column_format_str = ", ".join(["%s"] * len(self.column_names))
 
         self.db_write_cmd = (
@@ -83,23 +160,43 @@ class MariaDatabase:
             + ")"
         )
 
-        # SQL read commenad is used only for testing this module,
-        # Weather Station only writes to DB
-        self.db_read_cmd = os.environ.get("WS_DB_READ_CMD")
-        if self.db_read_cmd == None:
-            self.db_read_cmd = "SELECT * FROM {0} ORDER BY id DESC LIMIT 5".format(
-                self.db_table
+    """
+    Follows the schema of the table, w_dir_code is written and rollups are
+    kept per station_id once migrate.py has swapped in the version 2 table,
+    also while the station is running.
+    """
+
+    def _check_schema(self, connection):
+        if "w_dir" not in self.column_names and not self.rollups:
+            return
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+                "AND COLUMN_NAME IN ('w_dir_code', 'station_id')",
+                (self.db_table,),
             )
+            found = [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+        if self.rollups:
+            self.rollups.has_station = "station_id" in found
+        use_dir_code = "w_dir_code" in found and "w_dir" in self.column_names
+        if use_dir_code != (self.dir_index is not None):
+            logging.info("DB-IF: Table %s, w_dir_code %s", self.db_table, use_dir_code)
+            self._set_write_cmd(use_dir_code)
 
     """
     Opens DB connection and connects cursor. In the event of a network issue,
-    a ErrorNetworkIssue is thrown.
+    a ErrorNetworkIssue is thrown. Connections are taken from the pool when
+    one is idle and still alive, otherwise a new connection is made.
     """
 
     def open_db(self):
+        self.connection_failed = False
         try:
-            logging.info("DB-IF: Try connect()")
-            self.connection = mysql.connector.connect(**self.connection_params)
+            self.connection = self._get_connection()
             logging.info("DB-IF: Try cursor()")
             self.cursor = self.connection.cursor()
         except (
@@ -108,12 +205,67 @@ class MariaDatabase:
         ) as e:
             logging.info("DB-IF: Error OperationError or InterfaceError")
             logging.info("DB-IF: Thrown %s", e)
+            self.connection = None
             raise ErrorNetworkIssue
         except Exception as e:
             logging.error("DB-IF: Error NOT OperationError or InterfaceError")
             logging.error("DB-IF: Thrown %s", e)
+            self.connection = None
             raise e
 
+    """
+    Returns a connection. Pooled connections idle longer than pool_idle are
+    checked with ping() and dropped if dead, the others cost no round trip, a
+    dead one fails its statement and is closed by close_db(). A new connection is tried connect_retries + 1 times,
+    each attempt bounded by connect_timeout, before the error is passed on.
+    """
+
+    def _get_connection(self):
+        while self.pool:
+            connection, returned = self.pool.pop()
+            if time.monotonic() - returned < self.pool_idle:
+                return connection
+            try:
+                logging.info("DB-IF: Try ping() pooled connection")
+                connection.ping(reconnect=False)
+                return connection
+            except mysql.connector.Error as e:
+                logging.info("DB-IF: Pooled connection dead, discarded: %s", e)
+                self._discard_connection(connection)
+
+        attempt = 0
+        while True:
+            try:
+                logging.info("DB-IF: Try connect()")
+                connection = mysql.connector.connect(**self.connection_params)
+                try:
+                    self._check_schema(connection)
+                except mysql.connector.Error:
+                    self._discard_connection(connection)
+                    raise
+                return connection
+            except (
+                mysql.connector.errors.OperationalError,
+                mysql.connector.errors.InterfaceError,
+            ) as e:
+                attempt += 1
+                if attempt > self.connect_retries:
+                    raise
+                logging.info("DB-IF: connect() attempt %s failed: %s", attempt, e)
+                time.sleep(self.retry_delay)
+
+    # Entry with the w_dir point replaced by its code, None stays NULL
+    def _encode_dir(self, entry):
+        entry = list(entry)
+        entry[self.dir_index] = self.dir_codes.get(entry[self.dir_index])
+        return tuple(entry)
+
+    def _discard_connection(self, connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logging.debug("DB-IF: Ignored error closing connection: %s", e)
+
     """
     send_data requires connection to DB before calling this function.
     Also, routine does not close connection.
@@ -132,6 +284,12 @@ class MariaDatabase:
                 # Data must be tuple or list of tuples
                 exit(1)
 
+        if self.dir_index is not None:
+            if multi_entry:
+                entries = [self._encode_dir(e) for e in entries]
+            else:
+                entry = self._encode_dir(entry)
+
         # Assumes connection is open and good
         try:
             if multi_entry:
@@ -140,6 +298,9 @@ class MariaDatabase:
             else:
                 logging.info("DB-IF: Try execute()")
                 self.cursor.execute(cmd, entry)
+            if self.rollups:
+                # Same transaction, buckets are recomputed from stored rows
+                self.rollups.update(self.cursor, entries if multi_entry else [entry])
             logging.info("DB-IF: Try comit()")
             self.connection.commit()
 
@@ -147,7 +308,26 @@ class MariaDatabase:
             logging.info("DB-IF: Error OperationError or InterfaceError")
             logging.info("DB-IF: Thrown %s", e)
             logging.info("DB-IF: Try rollback()")
+            self.connection_failed = True
+            try:
+                self.connection.rollback()
+            except mysql.connector.Error as rollback_error:
+                logging.info("DB-IF: rollback() failed: %s", rollback_error)
+            raise ErrorNetworkIssue
+        except mysql.connector.Error as e:
+            if e.errno not in SCHEMA_ERRORS:
+                logging.error("DB-IF: Error NOT OperationError or InterfaceError")
+                logging.info("DB-IF: Thrown %s", e)
+                logging.info("DB-IF: Try rollback()")
+                self.connection.rollback()
+                raise e
+            # Entries stay queued and are sent again with the new columns
+            logging.warning("DB-IF: Table changed, check schema: %s", e)
             self.connection.rollback()
+            try:
+                self._check_schema(self.connection)
+            except mysql.connector.Error as check_error:
+                logging.info("DB-IF: Schema check failed: %s", check_error)
             raise ErrorNetworkIssue
         except Exception as e:
             logging.error("DB-IF: Error NOT OperationError or InterfaceError")
@@ -156,12 +336,35 @@ class MariaDatabase:
             self.connection.rollback()
             raise e
 
-    # Closes cursor and connection
+    """
+    Closes cursor and returns connection to the pool. Connections whose last
+    statement failed on the network, or that do not fit in the pool, are
+    closed. Safe to call more than once.
+    """
+
     def close_db(self):
-        logging.info("DB-IF: Try cursor.close()")
-        self.cursor.close()
-        logging.info("DB-IF: Try connection.close()")
-        self.connection.close()
+        if self.cursor is not None:
+            logging.info("DB-IF: Try cursor.close()")
+            try:
+                self.cursor.close()
+            except Exception as e:
+                logging.debug("DB-IF: Ignored error closing cursor: %s", e)
+            self.cursor = None
+
+        if self.connection is not None:
+            if len(self.pool) < self.pool_size and not self.connection_failed:
+                logging.info("DB-IF: Return connection to pool")
+                self.pool.append((self.connection, time.monotonic()))
+            else:
+                logging.info("DB-IF: Try connection.close()")
+                self._discard_connection(self.connection)
+            self.connection = None
+
+    # Closes every pooled connection, used on shutdown
+    def close_pool(self):
+        self.close_db()
+        while self.pool:
+            self._discard_connection(self.pool.pop()[0])
 
     def is_connected_db(self):
         logging.info("DB-IF: Try connection.is_connected()")
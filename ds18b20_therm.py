@@ -1,5 +1,8 @@
 #!/usr/bin/python3
-import os, glob, time
+import os, glob, time, logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from hardware import W1_DEVICES, clock
 
 # add the lines below to /etc/modules (reboot to take effect)
 # w1-gpio
@@ -7,11 +10,52 @@ import os, glob, time
 
 
 class DS18B20(object):
-    def __init__(self):
-        self.device_file = glob.glob("/sys/bus/w1/devices/28*")[0] + "/w1_slave"
+    """
+    Reads every DS18B20 probe on the 1-Wire bus. A read takes about 750 ms,
+    probes are read at the same time in a thread pool so N probes take about
+    as long as one.
+    rescan_interval: seconds between searches for added or removed probes
+    read_timeout: seconds allowed for a read, probes not done are None
+    """
+
+    def __init__(self, rescan_interval=600, read_timeout=2.0):
+        self.rescan_interval = rescan_interval
+        self.read_timeout = read_timeout
+
+        # Probe ID, e.g. 28-00000a1b2c3d, to its w1_slave file
+        self.device_files = {}
+        self.last_scan = None
+        # Reads still running after their timeout, not started again
+        self.pending = {}
+        self.executor = None
+
+        self.scan()
 
-    def read_temp_raw(self):
-        f = open(self.device_file, "r")
+    # Finds probes, raises IndexError like before if there are none
+    def scan(self):
+        device_files = {
+            os.path.basename(path): os.path.join(path, "w1_slave")
+            for path in glob.glob(os.path.join(W1_DEVICES, "28*"))
+        }
+        if not device_files:
+            raise IndexError("No DS18B20 probe in " + W1_DEVICES)
+
+        if device_files.keys() != self.device_files.keys():
+            logging.info("DS18B20: Probes %s", ", ".join(sorted(device_files)))
+            if self.executor:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(
+                max_workers=len(device_files), thread_name_prefix="DS18B20"
+            )
+        self.device_files = device_files
+        self.last_scan = clock.monotonic()
+
+        # First probe, read by read_first() and read_temp()
+        self.first_probe = min(device_files)
+        self.device_file = device_files[self.first_probe]
+
+    def read_temp_raw(self, device_file=None):
+        f = open(device_file if device_file else self.device_file, "r")
         lines = f.readlines()
         f.close()
         return lines
@@ -19,16 +63,17 @@ class DS18B20(object):
     def crc_check(self, lines):
         return lines[0].strip()[-3:] == "YES"
 
-    def read_temp(self):
+    # Reads one probe, -255 if CRC fails 4 times
+    def read_probe(self, device_file):
         temp_c = -255
         attempts = 0
 
-        lines = self.read_temp_raw()
+        lines = self.read_temp_raw(device_file)
         success = self.crc_check(lines)
 
         while not success and attempts < 3:
             time.sleep(0.2)
-            lines = self.read_temp_raw()
+            lines = self.read_temp_raw(device_file)
             success = self.crc_check(lines)
             attempts += 1
 
@@ -41,6 +86,50 @@ class DS18B20(object):
 
         return temp_c
 
+    """
+    Returns dict of probe ID to temperature. A probe is None if its read failed
+    or was not done within read_timeout.
+    """
+
+    def read_all(self):
+        if clock.monotonic() - self.last_scan > self.rescan_interval:
+            try:
+                self.scan()
+            except IndexError as e:
+                logging.warning("DS18B20: %s", e)
+
+        futures = {}
+        busy = {}
+        for probe, device_file in self.device_files.items():
+            if probe in self.pending and not self.pending[probe].done():
+                logging.warning("DS18B20: %s still busy, skipped", probe)
+                busy[probe] = self.pending[probe]
+                continue
+            futures[probe] = self.executor.submit(self.read_probe, device_file)
+
+        wait(futures.values(), timeout=self.read_timeout)
+
+        readings = {probe: None for probe in self.device_files}
+        self.pending = busy
+        for probe, future in futures.items():
+            if not future.done():
+                logging.warning("DS18B20: %s read timed out", probe)
+                self.pending[probe] = future
+            elif future.exception():
+                logging.warning("DS18B20: %s %s", probe, future.exception())
+            elif future.result() != -255:
+                readings[probe] = future.result()
+        return readings
+
+    # Temperature of first probe, None if it could not be read
+    def read_first(self):
+        return self.read_all().get(self.first_probe)
+
+    # Temperature of first probe, -255 if it could not be read
+    def read_temp(self):
+        temp_c = self.read_first()
+        return -255 if temp_c is None else temp_c
+
 
 if __name__ == "__main__":
     import time
@@ -49,7 +138,7 @@ if __name__ == "__main__":
 
     loop_count = 0
     while loop_count < 10:
-        result = round(obj.read_temp(), 1)
-        print("Temp = {} C".format(result))
+        for probe, result in obj.read_all().items():
+            print("{} Temp = {} C".format(probe, result))
         time.sleep(0.5)
         loop_count += 1
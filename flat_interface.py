@@ -1,13 +1,97 @@
 import os
 import logging
 import json
+from json.encoder import encode_basestring_ascii
 
 from errors import ErrorNetworkIssue
+from buffered_file import BufferedFile
+
+# Optional, faster encoder with compact output
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Same text as json.dumps() for the types a record holds
+def _encode_float(value):
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "Infinity"
+    if value == -float("inf"):
+        return "-Infinity"
+    return float.__repr__(value)
+
+
+VALUE_ENCODERS = {
+    str: encode_basestring_ascii,
+    float: _encode_float,
+    int: int.__repr__,
+    bool: lambda value: "true" if value else "false",
+    type(None): lambda value: "null",
+}
+
+
+class RowEncoder:
+    """
+    Encodes entries as json lines, the same text json.dump() of a dict of
+    field names writes. Key text is built once from the field names, each
+    value is formatted by a per type function. Other types fall back to
+    json.dumps().
+    use_orjson: encode with orjson if installed, output has no spaces
+    """
+
+    def __init__(self, field_names, eol=os.linesep, use_orjson=False):
+        self.field_names = field_names
+        self.eol = eol
+        self.orjson = orjson if use_orjson else None
+
+        # '{"time": ', ', "ws_ave": ', ...
+        self.prefixes = [
+            ("{" if index == 0 else ", ") + encode_basestring_ascii(name) + ": "
+            for index, name in enumerate(field_names)
+        ]
+        self.suffix = "}" + eol
+
+    def encode(self, entry):
+        if self.orjson:
+            return (
+                self.orjson.dumps(
+                    dict(zip(self.field_names, entry)),
+                    option=self.orjson.OPT_SERIALIZE_NUMPY,
+                ).decode()
+                + self.eol
+            )
+        parts = []
+        for prefix, value in zip(self.prefixes, entry):
+            parts.append(prefix)
+            encoder = VALUE_ENCODERS.get(type(value))
+            parts.append(encoder(value) if encoder else json.dumps(value))
+        parts.append(self.suffix)
+        return "".join(parts)
+
+    # Text of all entries, written with one write()
+    def encode_rows(self, entries):
+        return "".join([self.encode(entry) for entry in entries])
+
 
 class FlatDatabase:
-    """ """
+    """
+    File is kept open between writes, see buffered_file.py for
+    flush_rows, flush_interval and fsync.
+    use_orjson: see RowEncoder
+    """
 
-    def __init__(self, column_names, flat_config):
+    def __init__(
+        self,
+        column_names,
+        flat_config,
+        flush_rows=1,
+        flush_interval=60.0,
+        fsync=False,
+        use_orjson=False,
+    ):
 
         self.field_names = column_names
         self.flat_file_name = flat_config
@@ -31,6 +115,11 @@ class FlatDatabase:
             with open(self.flat_file_name, "a", newline=self.eol) as self.file_handle:
                 pass
 
+        self.file = BufferedFile(self.flat_file_name, flush_rows, flush_interval, fsync)
+        self.encoder = RowEncoder(self.field_names, self.eol, use_orjson)
+        if use_orjson and orjson is None:
+            logging.warning("FLAT: orjson not installed, using built in encoder")
+
     """
     Opens DB connection and connects cursor. In the event of a network issue,
     a ErrorNetworkIssue is thrown.
@@ -38,35 +127,21 @@ class FlatDatabase:
 
     def open_db(self):
         # try:
-        self.file_handle = open(self.flat_file_name, "a")
+        if self.file.open():
+            self.file_handle = self.file.handle
 
     """
     send_data requires connection to DB before calling this function.
     Also, routine does not close connection.
+    With multi_entry, entry is a list of entries written with one write().
     """
 
     def send_data(self, entry, multi_entry=False):
-
-        self.dict_entry = {}
-        for count, key in enumerate(self.field_names):
-            self.dict_entry[key] = entry[count]
-
-        # if multi_entry:
-        #     if type(entry) is tuple:
-        #         entries = [entry]
-        #     elif type(entry) is list:
-        #         entries = entry
-        #     else:
-        #         # Data must be tuple or list of tuples
-        #         exit(1)
-
         # Assumes connection is open and good
-        # try:
-        #     if multi_entry:
-        #         self.flat_writer.writerow(entry)
-        #     else:
-        json.dump(self.dict_entry, self.file_handle)
-        self.file_handle.write(self.eol)
+        if multi_entry:
+            self.file.write(self.encoder.encode_rows(entry), len(entry))
+        else:
+            self.file.write(self.encoder.encode(entry))
         # except (mysql.connector.OperationalError, mysql.connector.InterfaceError) as e:
         #     logging.debug(f"Warming Exception in write_one_db() Operational Error: {e}")
         #     logging.warn(f"Warning Exception in write_one_db() Operational Error: {e}")
@@ -75,9 +150,22 @@ class FlatDatabase:
         # except Exception as e:
         #      raise e
 
-    # Closes cursor and connection
-    def close_db(self):
-        self.file_handle.close()
+    # Rows written but not yet flushed to the file
+    def unflushed(self):
+        return self.file.unflushed
+
+    # Flushes rows written, whatever the flush policy
+    def flush(self):
+        self.file.flush()
+
+    # End of a drain, file stays open and is flushed per flush policy, or
+    # now with flush
+    def close_db(self, flush=False):
+        self.file.end(flush)
+
+    # Flushes and closes file, call before program exits
+    def close(self):
+        self.file.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+import threading
+
+"""Selects the hardware backend for the weather station.
+WS_HARDWARE=pi (default) uses the Raspberry Pi libraries, WS_HARDWARE=sim
+uses the simulated hardware in sim_hardware.py, which runs anywhere.
+Sensor modules import Button, MCP3008, bme280, smbus2, the 1-Wire device
+directory and the clock from here instead of from the libraries.
+new_event_loop() returns the asyncio loop to run the station on, its time
+is the clock's monotonic time."""
+
+
+class PiClock:
+    """The time module, plus sample_every() as in sim_hardware.SimClock."""
+
+    monotonic = staticmethod(time.monotonic)
+    monotonic_ns = staticmethod(time.monotonic_ns)
+    perf_counter = staticmethod(time.perf_counter)
+    sleep = staticmethod(time.sleep)
+    time = staticmethod(time.time)
+
+    """
+    Calls callback() now and every period seconds after on a fixed grid, a
+    late call does not move later ones, until stop_event is set. Runs in a
+    new thread, which is returned for join().
+    """
+
+    def sample_every(self, period, callback, stop_event):
+        def run():
+            next_time = self.monotonic()
+            while not stop_event.is_set():
+                callback()
+                next_time += period
+                delay = next_time - self.monotonic()
+                if delay < 0:
+                    next_time -= delay
+                    delay = 0
+                stop_event.wait(delay)
+
+        thread = threading.Thread(target=run, name="Sampler", daemon=True)
+        thread.start()
+        return thread
+
+
+HARDWARE = os.environ.get("WS_HARDWARE", "pi")
+
+if HARDWARE == "sim":
+    from types import SimpleNamespace
+
+    import sim_hardware
+
+    station = sim_hardware.get_station()
+    clock = station.clock
+
+    Button = sim_hardware.SimButton
+    MCP3008 = sim_hardware.SimMCP3008
+    bme280 = sim_hardware.SimBME280()
+    smbus2 = SimpleNamespace(SMBus=sim_hardware.SimSMBus)
+
+    W1_DEVICES = station.w1_devices(int(os.environ.get("WS_SIM_PROBES", 1)))
+
+    def new_event_loop():
+        return sim_hardware.SimEventLoop(clock)
+
+else:
+    from gpiozero import Button, MCP3008
+    import bme280
+    import smbus2
+
+    clock = PiClock()
+
+    W1_DEVICES = "/sys/bus/w1/devices"
+
+    new_event_loop = asyncio.new_event_loop
@@ -1,15 +1,20 @@
-import debugpy
+import hardware
 
-debugpy.listen(5678)
+# Remote debugger only on the Pi, simulated runs may start many times
+if hardware.HARDWARE != "sim":
+    import debugpy
+
+    debugpy.listen(5678)
 
 """Weather Station code"""
 import math
 import time
-import statistics
 import logging
 
+import numpy as np
+
 from datetime import datetime
-from gpiozero import Button
+from hardware import Button, clock
 
 # Sensor modules
 import bme280_sensor
@@ -19,7 +24,10 @@ import ds18b20_therm
 # from ws_database import MariaDatabase
 # from db_interface import MariaDatabase
 import wind_direction
+import pulse_buffer
 from data_mgr import DataMgr
+from scheduler import Scheduler
+from acquisition import SensorAcquisition
 
 """
 logging.basicConfig(
@@ -72,15 +80,36 @@ vars2params = [
     "rainfall",
 ]
 
+"""Optional columns, added with main(wind_columns=True). The database table
+needs these columns, see Maria/SQL/addwindcolumns.sql"""
+wind_column_names = [
+    "w_dir_deg",
+    "w_dir_wdeg",
+    "w_dir_std",
+    "ws_lull",
+]
+wind_vars2params = [
+    "wind_direction_degrees",
+    "wind_direction_weighted",
+    "wind_direction_std",
+    "wind_speed_lull",
+]
+
 # Global variables
 wind_count = 0  # Global var Counts rotations of anemometer
 rain_count = 0  # Global to count number of times rain bucket tips
 
 """Wind speed and direction measurements are sampled over a period of time.
-ToDo: Add statement why time will slip with time/interval values"""
+Each sample and each record starts at an absolute deadline on the monotonic
+clock (see scheduler.py), so loop and sensor overhead does not accumulate."""
 WIND_MEASUREMENT_TIME = 7  # In seconds, Report speed every 7 seconds
 WIND_MEASUREMENT_INTERVAL = 5  # In minutes, Measurements recorded every 5 minutes
 
+# Slow sensors are read in parallel during the last wind sample, in seconds
+# each one is allowed before it is recorded as NULL
+BME280_TIMEOUT = 1.0
+DS18B20_TIMEOUT = 3.0
+
 # Constants
 CM_IN_A_KM = 100000.0
 SEC_IN_HOUR = 3600
@@ -94,10 +123,17 @@ RAIN_SENSOR_BUTTON = 6
 RADIUS_CM = 9.0  # radius of anemometer
 CIRCUMFERENCE_CM = 2 * math.pi * RADIUS_CM
 
+# Wind speed for one spin per second, 2 spins per rotation
+KMH_PER_HZ = CIRCUMFERENCE_CM / 2.0 / CM_IN_A_KM * SEC_IN_HOUR * ANEMOMETER_FACTOR
+
+# Timestamp of every spin, used for 3 second gust
+wind_pulses = pulse_buffer.PulseRingBuffer()
+
 # Interrupt process for Spin connected to GPIO(5)
 def spin():
     global wind_count
     wind_count += 1
+    wind_pulses.record(clock.monotonic_ns())
 
 
 wind_speed_sensor = Button(WIND_SPEED_SENSOR_BUTTON)
@@ -127,139 +163,283 @@ class WindSpeedDirThread:
     thread_name: Arbitrary name
     measurement_time: is seconds, period of time to make 1 measurement, recomdnd % 60
     measurement_count: is number of measurements to aquire
+    vane_rate: vane samples per second in background, 0 reads vane once per
+        measurement
     """
 
-    def __init__(self, measurement_time, measurement_count):
+    def __init__(self, measurement_time, measurement_count, vane_rate=20):
         # super().__init__()
         # Calling the Thread class's init function
         # Thread.__init__(self)
         # self.thread_name = thread_name
         self.measurement_time = measurement_time
         self.measurement_count = measurement_count
-        self.wind_direction_data = []
-        self.wind_speed_data = []
-
-    def calculate_speed(self):
-        rotations = wind_count / 2.0
+        # One value per sample, direction in degrees and NaN if not read
+        self.wind_direction_data = np.full(measurement_count, np.nan)
+        self.wind_speed_data = np.zeros(measurement_count)
+        self.wind_stats = None
+        self.wind_vector = None
+        self.scheduler = Scheduler(clock)
+        # One vane for the life of the program
+        self.direction = wind_direction.WindDirection()
+
+        # Directions, in degrees, used for direction statistics
+        self.direction_samples = self.wind_direction_data
+        self.vane_sampler = None
+        if vane_rate > 0:
+            capacity = int(vane_rate * measurement_time * (measurement_count + 1))
+            self.vane_sampler = wind_direction.VaneSampler(
+                self.direction, vane_rate, capacity, clock
+            )
+
+    # Speed from anemometer counts over the actual length of the sample
+    def calculate_speed(self, count, elapsed_time):
+        rotations = count / 2.0
 
         # Calculate distance
         dist_km = (CIRCUMFERENCE_CM * rotations) / CM_IN_A_KM
-        speed_km_hr = (dist_km / self.measurement_time) * SEC_IN_HOUR
+        speed_km_hr = (dist_km / elapsed_time) * SEC_IN_HOUR
         return speed_km_hr * ANEMOMETER_FACTOR
 
     def calculate_dir(self):
-        direction = wind_direction.WindDirection()
-        result = direction.get_direction()
-
-        # try at least twice for a good direction result
-        if result == None:
-            # None indicate a strange corner case changing between 2 values
-            logging.debug("*** Direction Re-Measure ***")
-            time.sleep(0.01)
-            return direction.get_direction()
-        else:
-            return result
+        return self.direction.get_direction()
 
-    def run(self):
+    """
+    start: monotonic deadline of first sample, defaults to now.
+    Sample n ends at start + n * measurement_time. wind_count is never reset,
+    each sample uses the counts since the previous sample so no spin is lost.
+    last_sample: called when the last sample starts, used to start sensor
+    reads so they are done when the window ends.
+    """
+
+    def run(self, start=None, last_sample=None):
         logging.info("Starting Wind/Direction Measurement")
         # print("Starting {} Thread".format(self.thread_name))
-        global wind_count
-        self.wind_direction_data = []
-        self.wind_speed_data = []
-        loop_count = self.measurement_count
-
-        while loop_count > 0:
-            logging.info("Loop {} = {:.03f}".format(loop_count, time.time()))
-            wind_count = 0
-            time.sleep(self.measurement_time)
-            temp = self.calculate_speed()
-            self.wind_speed_data.append(temp)
+        self.wind_direction_data.fill(np.nan)
+        self.wind_speed_data.fill(0.0)
+        self.scheduler.reset_jitter()
+
+        if start is None:
+            start = self.scheduler.clock.monotonic()
+        self.scheduler.wait_until(start)
+        last_time = self.scheduler.clock.monotonic()
+        last_count = wind_count
+        start_ns = clock.monotonic_ns()
+        if self.vane_sampler:
+            self.vane_sampler.start()
+
+        for loop_count in range(1, self.measurement_count + 1):
+            if loop_count == self.measurement_count and last_sample:
+                last_sample()
+            self.scheduler.wait_until(start + loop_count * self.measurement_time)
+            count = wind_count
+            now = self.scheduler.clock.monotonic()
+            logging.info("Loop {} = {:.03f}".format(loop_count, now))
+
+            temp = self.calculate_speed(count - last_count, now - last_time)
+            last_count = count
+            last_time = now
+            self.wind_speed_data[loop_count - 1] = temp
             logging.debug("Wind Speed = {:.01f}".format(temp))
-            # self.wind_speed.append(self.calculate_speed())
-            value = self.calculate_dir()
-            # value = WindDirection.get_direction()
-            self.wind_direction_data.append(value)
-            logging.debug("Wind Dir = %s", value)
-            # logging.debug("Wind Dir = {}".format(value))
-            # store_speeds.append(speed_km_hr)
-            loop_count -= 1
+            if self.vane_sampler is None:
+                value = self.calculate_dir()
+                self.wind_direction_data[
+                    loop_count - 1
+                ] = wind_direction.COMPASS_DEGREES.get(value, np.nan)
+                logging.debug("Wind Dir = %s", value)
+
+        end_ns = clock.monotonic_ns()
+        if self.vane_sampler:
+            # Pair each vane sample with the speed of the sample it fell in
+            times, codes = self.vane_sampler.stop()
+            self.direction_samples = codes * wind_direction.DEGREES_PER_POINT
+            index = ((times - start) / self.measurement_time).astype(int)
+            speeds = self.wind_speed_data[
+                np.clip(index, 0, self.measurement_count - 1)
+            ]
+            logging.debug("Vane samples = %s", len(codes))
+        else:
+            self.direction_samples = self.wind_direction_data
+            speeds = self.wind_speed_data
+
+        self.wind_vector = wind_direction.wind_vector_statistics(
+            speeds, self.direction_samples
+        )
+        self.wind_stats = pulse_buffer.wind_statistics(
+            wind_pulses.window(start_ns, end_ns), start_ns, end_ns, KMH_PER_HZ
+        )
+        logging.debug(
+            "Wind 3s gust = %.01f, lull = %.01f, current = %.01f",
+            self.wind_stats.gust,
+            self.wind_stats.lull,
+            self.wind_stats.current,
+        )
+
+        logging.info(
+            "Sample jitter mean = %.04f s, max = %.04f s",
+            self.scheduler.jitter_mean(),
+            self.scheduler.jitter_max,
+        )
         return
 
     def get_wind_speed_average(self):
-        return statistics.mean(self.wind_speed_data)
+        return float(self.wind_speed_data.mean())
 
+    # WMO gust, highest 3 second mean speed of the window
     def get_wind_speed_gust(self):
+        return self.wind_stats.gust
 
-        return max(self.wind_speed_data)
+    def get_wind_speed_lull(self):
+        return self.wind_stats.lull
 
+    # Most common compass point, None if no direction was read
     def get_wind_dir_mode(self):
-        return statistics.mode(self.wind_direction_data)
+        valid = self.direction_samples[~np.isnan(self.direction_samples)]
+        if len(valid) == 0:
+            return None
+        points = np.rint(valid / wind_direction.DEGREES_PER_POINT).astype(int) % 16
+        return wind_direction.COMPASS_POINTS[int(np.bincount(points).argmax())]
+
+    # Compass point of the vector mean direction, handles wrap around north
+    def get_wind_dir_mean(self):
+        return wind_direction.compass_point(self.wind_vector.direction)
+
+
+# None and NaN are not a measurement, both are stored as NULL
+def optional_round(value, digits=1):
+    if value is None or math.isnan(value):
+        return None
+    return round(value, digits)
 
 
 """kwargs is passed to db_mgr and are used to configure how data is stored"""
 
 
 def main(**kwargs):
+    # Number of records to measure before returning, forever if None.
+    # Not a storage setting so not passed to DataMgr
+    max_records = kwargs.pop("max_records", None)
+    # Vane samples per second, 0 reads vane once per wind measurement
+    vane_rate = kwargs.pop("vane_rate", 20)
+
+    # Optional vector wind direction columns, see wind_column_names
+    record_column_names = list(column_names)
+    record_vars2params = list(vars2params)
+    if kwargs.pop("wind_columns", False):
+        record_column_names += wind_column_names
+        record_vars2params += wind_vars2params
 
     # Initialize all measurement objects
     speed_and_dir = WindSpeedDirThread(
         WIND_MEASUREMENT_TIME,
         WIND_MEASUREMENT_INTERVAL * (int(60 / WIND_MEASUREMENT_TIME)),
+        vane_rate,
     )
 
     # Temperature, humidity, and pressure sensor
     # and Ground thermal sensor
-    bme = bme280_sensor.temperature_sensor()
-    therm = ds18b20_therm.DS18B20()
+    bme = bme280_sensor.BME280Sensor()
+    therm = ds18b20_therm.DS18B20(read_timeout=DS18B20_TIMEOUT - 0.5)
+
+    # Both are read at the same time, overlapping the end of the wind window
+    sensors = SensorAcquisition()
+    sensors.add_sensor("bme", bme.read, BME280_TIMEOUT)
+    sensors.add_sensor("therm", therm.read_first, DS18B20_TIMEOUT)
 
     # db_mgr opens Maria DB, optionally opens files to store CVS or jswon data.
     # Must exit from main() if data cannot be saved.
     try:
-        db_mgr = DataMgr(column_names, **kwargs)
+        db_mgr = DataMgr(record_column_names, **kwargs)
     except Exception as e:
         logging.error("Error Cannot open data storage: %s", e)
         raise
 
     # Just to be neat, Set start time to occur when second changes
-    start_time = int(time.time()) + 1
+    scheduler = Scheduler(clock)
+    start_time = scheduler.deadline_at(int(clock.time()) + 1)
     logging.debug("Start Time = {:.03f}".format(start_time))
 
     # Infinite loop to measure sensor values CTRL-C required to exit.
-    while True:
-        logging.debug(
-            "Start Time {:.03f} ; Current Time {:.03f}".format(start_time, time.time())
+    try:
+        measurement_loop(
+            speed_and_dir,
+            sensors,
+            db_mgr,
+            scheduler,
+            start_time,
+            record_vars2params,
+            max_records,
         )
-
-        while start_time > time.time():
-            time.sleep(0.01)
+    finally:
+        sensors.close()
+        # Writes queued entries, anything not written stays in spool file
+        db_mgr.close()
+
+
+def measurement_loop(
+    speed_and_dir,
+    sensors,
+    db_mgr,
+    scheduler,
+    start_time,
+    record_vars2params,
+    max_records=None,
+):
+    record_count = 0
+    while max_records is None or record_count < max_records:
+        jitter = scheduler.wait_until(start_time)
+        logging.debug("Start Time {:.03f} ; Jitter {:.04f}".format(start_time, jitter))
 
         # Run measurements for wind speed and direction
-        # This measurement runs for WIND_MEASUREMENT_INTERVAL minutes
-        speed_and_dir.run()
-
-        # Collect data from other sensors
-        logging.info("Time of Measurement = {:.03f}".format(time.time()))
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # This measurement runs for WIND_MEASUREMENT_INTERVAL minutes,
+        # other sensors are read during its last sample
+        speed_and_dir.run(start_time, sensors.start)
 
-        humidity, pressure, temperature = bme.read_all_bme820()
-        humidity = round(humidity, 1)
-        pressure = round(pressure, 1)
-        temperature = round(temperature, 1)
-        logging.debug("Humidity = {:.01f}".format(humidity))
-        logging.debug("Pressure = {:.01f}".format(pressure))
-        logging.debug("Temperature = {:.01f}".format(temperature))
+        # Rain counter is read right at the boundary, it takes no time
+        rainfall = round(get_and_reset_rainfall(), 3)
 
-        ground_temperature = round(therm.read_temp(), 1)
-        logging.debug("Ground Temperature = {:.01f}".format(ground_temperature))
+        # Record is stamped with the scheduled start of its interval, not
+        # when the window ended or the record is stored
+        end_time = scheduler.wall_time(
+            start_time + speed_and_dir.measurement_count * speed_and_dir.measurement_time
+        )
+        logging.info("Time of Measurement = {:.03f}".format(end_time))
+        current_time = datetime.fromtimestamp(
+            round(scheduler.wall_time(start_time))
+        ).strftime("%Y-%m-%d %H:%M:%S")
+
+        # A failed or late read is stored as NULL, the loop keeps running
+        readings = sensors.collect()
+        bme_reading = readings["bme"]
+        if bme_reading is None:
+            bme_reading = bme280_sensor.BME280Reading(
+                None, None, None, None, None, "timed out"
+            )
+        humidity = optional_round(bme_reading.humidity)
+        pressure = optional_round(bme_reading.pressure)
+        temperature = optional_round(bme_reading.temperature)
+        logging.debug("Humidity = %s", humidity)
+        logging.debug("Pressure = %s", pressure)
+        logging.debug("Temperature = %s", temperature)
+
+        ground_temperature = optional_round(readings["therm"])
+        logging.debug("Ground Temperature = %s", ground_temperature)
 
-        rainfall = round(get_and_reset_rainfall(), 3)
         logging.debug("Rainfall = {:.03f}".format(rainfall))
 
         wind_speed_average = speed_and_dir.get_wind_speed_average()
         wind_speed_average = round(wind_speed_average, 1)
         wind_speed_gust = speed_and_dir.get_wind_speed_gust()
         wind_speed_gust = round(wind_speed_gust, 1)
-        wind_direction_value = speed_and_dir.get_wind_dir_mode()
+        wind_direction_value = speed_and_dir.get_wind_dir_mean()
+
+        # Optional columns, NaN is stored as NULL
+        wind_direction_degrees = optional_round(speed_and_dir.wind_vector.direction)
+        wind_direction_weighted = optional_round(
+            speed_and_dir.wind_vector.weighted_direction
+        )
+        wind_direction_std = optional_round(speed_and_dir.wind_vector.direction_std)
+        wind_speed_lull = round(speed_and_dir.get_wind_speed_lull(), 1)
 
         logging.debug("Wind Speed = %.01f", wind_speed_average)
         logging.debug("Wind Gust = %.01f", wind_speed_gust)
@@ -284,15 +464,18 @@ def main(**kwargs):
         # Loop through user supplyed variable names that contain the weather
         # station data and put into a list. Must evaluate "name" to get the data.
         params = []
-        for var in vars2params:
+        for var in record_vars2params:
             params.append(eval(var))
 
         # update_entries requires data formated as tuple
         db_mgr.update_entries(tuple(params))
+        record_count += 1
 
         # Calculate next start time
-        start_time += WIND_MEASUREMENT_INTERVAL * 60
-        logging.info("Next Start Time = {:.03f}".format(start_time))
+        start_time = scheduler.next_deadline(start_time, WIND_MEASUREMENT_INTERVAL * 60)
+        logging.info(
+            "Next Start Time = {:.03f}".format(scheduler.wall_time(start_time))
+        )
 
 
 if __name__ == "__main__":
@@ -307,6 +490,8 @@ if __name__ == "__main__":
         file_date = (datetime.today()).strftime("%y%m%d")
         flat_config_args = file_path + "flat_data." + file_date + ".txt"
         csv_config_args = file_path + "csv_data." + file_date + ".txt"
+        # Partitioned by day, so it does not matter when the program started
+        parquet_config_args = file_path + "parquet"
 
         # main(db_config=json_file_name)
         # main(db_config=json_file_name, csv_config="/tmp/test_csv.txt")
@@ -315,6 +500,9 @@ if __name__ == "__main__":
             db_config=json_file_name,
             csv_config=csv_config_args,
             # flat_config=flat_config_args,
+            # parquet_config=parquet_config_args,
+            spool_config="weather_station.spool",
+            async_writer=True,
         )
         # main(csv_config="/tmp/test_csv.csv")
     except Exception as e:
@@ -0,0 +1,305 @@
+import logging
+from datetime import datetime
+
+from wind_direction import COMPASS_POINTS
+
+"""Versioned schema migrations of the sensors table.
+
+The schema_version table has one row per migration applied. migrate() runs
+the migrations newer than the latest row, in order. Version 1 is the table
+made by Maria/SQL/createdb.sql.
+
+Version 2 makes the table fit for tens of millions of rows:
+    - primary key (id, time) and an index on time, range queries use the
+      index instead of scanning the table
+    - one RANGE partition per month on UNIX_TIMESTAMP(time), old months are
+      removed with DROP PARTITION instead of a slow DELETE
+    - station_id column, default 1
+    - plain FLOAT columns, FLOAT(4.1) rounded to 4 digits
+    - w_dir_code TINYINT, the index of the compass point. w_dir stays as a
+      virtual column so queries of w_dir keep working
+
+The migration runs online. Rows are copied to a new table in batches while
+the station keeps inserting, then the tables are swapped with one atomic
+RENAME and rows inserted during the copy are copied last. MariaDatabase
+checks the table for w_dir_code on each new connection and after an insert
+fails on a changed column, the station writes w_dir_code from the swap on
+and resends the entries of the failed insert. The old table is kept as
+sensors_v1, drop it once the new table is checked.
+
+Needs a user allowed to create, alter and rename tables:
+
+    python3 migrate.py --config json_admin.load
+    python3 migrate.py --config json_admin.load --drop-before 2020-01
+
+Run it monthly, e.g. from cron, to add partitions ahead of time."""
+
+VERSION_TABLE = "schema_version"
+
+# Columns of version 1 other than id, time and w_dir
+MEASUREMENTS = ["ws_ave", "ws_max", "humid", "press", "temp", "therm", "rain"]
+
+# Keeps ids of rows inserted during the swap clear of new ids
+ID_GAP = 1000
+
+FUTURE = "p_future"
+
+
+def schema_version(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS {} ("
+        "`version` INT NOT NULL PRIMARY KEY, "
+        "`applied` TIMESTAMP NOT NULL DEFAULT current_timestamp, "
+        "`description` VARCHAR(255) NULL)".format(VERSION_TABLE)
+    )
+    cursor.execute("SELECT MAX(version) FROM " + VERSION_TABLE)
+    version = cursor.fetchone()[0]
+    if version is None:
+        # Table from createdb.sql, record it as version 1
+        cursor.execute(
+            "INSERT INTO {} (version, description) VALUES (1, %s)".format(
+                VERSION_TABLE
+            ),
+            ("createdb.sql",),
+        )
+        version = 1
+    return version
+
+
+def table_columns(cursor, table):
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+        (table,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _month_start(t):
+    return t.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(t):
+    if t.month == 12:
+        return t.replace(year=t.year + 1, month=1)
+    return t.replace(month=t.month + 1)
+
+
+# PARTITION pYYYYMM for the month starting at month
+def _partition(month):
+    return "PARTITION p{} VALUES LESS THAN (UNIX_TIMESTAMP('{}'))".format(
+        month.strftime("%Y%m"), _next_month(month).strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+
+# Partitions for each month from first to months_ahead months after now
+def _partitions(first, months_ahead):
+    last = _month_start(datetime.now())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    month = _month_start(first)
+    partitions = []
+    while month <= last:
+        partitions.append(_partition(month))
+        month = _next_month(month)
+    partitions.append("PARTITION {} VALUES LESS THAN MAXVALUE".format(FUTURE))
+    return partitions
+
+
+def _direction_sql():
+    return ", ".join("'{}'".format(point) for point in COMPASS_POINTS)
+
+
+"""
+Version 2, see module docstring. batch_size rows are copied per
+transaction.
+"""
+
+
+def partition_sensors(connection, table, batch_size=10000, months_ahead=3):
+    cursor = connection.cursor()
+    old_table = table + "_v1"
+    new_table = table + "_v2"
+
+    columns = table_columns(cursor, table)
+    # Optional columns, e.g. from addwindcolumns.sql, are kept as FLOAT
+    optional = [
+        name
+        for name in columns
+        if name not in MEASUREMENTS and name not in ("id", "time", "w_dir")
+    ]
+    measurements = [name for name in MEASUREMENTS if name in columns] + optional
+
+    cursor.execute("SELECT MIN(`time`) FROM " + table)
+    first = cursor.fetchone()[0] or datetime.now()
+
+    cursor.execute("DROP TABLE IF EXISTS " + new_table)
+    cursor.execute(
+        "CREATE TABLE {} ("
+        "`id` BIGINT NOT NULL AUTO_INCREMENT, "
+        "`station_id` SMALLINT UNSIGNED NOT NULL DEFAULT 1, "
+        "`time` TIMESTAMP NOT NULL DEFAULT current_timestamp, "
+        "{}, "
+        "`w_dir_code` TINYINT UNSIGNED NULL, "
+        "`w_dir` CHAR(3) AS (ELT(`w_dir_code` + 1, {})) VIRTUAL, "
+        "PRIMARY KEY (`id`, `time`), "
+        "KEY `time_idx` (`time`), "
+        "KEY `station_time_idx` (`station_id`, `time`)"
+        ") PARTITION BY RANGE (UNIX_TIMESTAMP(`time`)) ({})".format(
+            new_table,
+            ", ".join("`{}` FLOAT NULL".format(name) for name in measurements),
+            _direction_sql(),
+            ", ".join(_partitions(first, months_ahead)),
+        )
+    )
+
+    copy_columns = ", ".join(["id", "`time`"] + measurements)
+    copy_sql = (
+        "INSERT INTO {0} ({1}, w_dir_code) "
+        "SELECT {1}, NULLIF(FIELD(w_dir, {2}), 0) - 1 FROM {3} "
+        "WHERE id > %s ORDER BY id"
+    )
+
+    # Copy in batches while the station keeps inserting into table
+    last_id = 0
+    copied = 0
+    while True:
+        cursor.execute(
+            copy_sql.format(new_table, copy_columns, _direction_sql(), table)
+            + " LIMIT %s",
+            (last_id, batch_size),
+        )
+        count = cursor.rowcount
+        connection.commit()
+        copied += count
+        if count < batch_size:
+            break
+        cursor.execute("SELECT MAX(id) FROM " + new_table)
+        last_id = cursor.fetchone()[0]
+        logging.info("MIGRATE: Copied %s rows", copied)
+
+    cursor.execute("SELECT MAX(id) FROM " + new_table)
+    last_id = cursor.fetchone()[0] or 0
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM " + table)
+    max_id = cursor.fetchone()[0]
+    cursor.execute(
+        "ALTER TABLE {} AUTO_INCREMENT = {}".format(new_table, int(max_id) + ID_GAP)
+    )
+
+    # Atomic swap, the station inserts into the new table from here on
+    cursor.execute(
+        "RENAME TABLE {0} TO {1}, {2} TO {0}".format(table, old_table, new_table)
+    )
+
+    # Rows inserted after the last batch
+    cursor.execute(
+        copy_sql.format(table, copy_columns, _direction_sql(), old_table),
+        (last_id,),
+    )
+    copied += cursor.rowcount
+    connection.commit()
+    logging.info("MIGRATE: Copied %s rows, old table kept as %s", copied, old_table)
+    cursor.close()
+
+
+# (version, description, function(connection, table))
+MIGRATIONS = [
+    (2, "partitioned sensors, time index, w_dir_code, station_id", partition_sensors),
+]
+
+
+def migrate(connection, table="sensors"):
+    cursor = connection.cursor()
+    version = schema_version(cursor)
+    connection.commit()
+    for number, description, function in MIGRATIONS:
+        if number <= version:
+            continue
+        logging.info("MIGRATE: Version %s, %s", number, description)
+        function(connection, table)
+        cursor.execute(
+            "INSERT INTO {} (version, description) VALUES (%s, %s)".format(
+                VERSION_TABLE
+            ),
+            (number, description),
+        )
+        connection.commit()
+        version = number
+    cursor.close()
+    return version
+
+
+def partition_names(cursor, table):
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+        "ORDER BY PARTITION_ORDINAL_POSITION",
+        (table,),
+    )
+    return [row[0] for row in cursor.fetchall() if row[0]]
+
+
+# Splits months up to months_ahead months from now out of p_future
+def add_partitions(connection, table="sensors", months_ahead=3):
+    cursor = connection.cursor()
+    months = [name for name in partition_names(cursor, table) if name != FUTURE]
+    if not months:
+        logging.warning("MIGRATE: %s is not partitioned", table)
+        return
+    month = _next_month(datetime.strptime(months[-1], "p%Y%m"))
+    partitions = _partitions(month, months_ahead)
+    if len(partitions) > 1:
+        cursor.execute(
+            "ALTER TABLE {} REORGANIZE PARTITION {} INTO ({})".format(
+                table, FUTURE, ", ".join(partitions)
+            )
+        )
+        logging.info("MIGRATE: Added %s partitions", len(partitions) - 1)
+    cursor.close()
+
+
+# Retention, drops the months before month, a datetime
+def drop_partitions(connection, table, month):
+    cursor = connection.cursor()
+    old = [
+        name
+        for name in partition_names(cursor, table)
+        if name != FUTURE and name < month.strftime("p%Y%m")
+    ]
+    if old:
+        cursor.execute(
+            "ALTER TABLE {} DROP PARTITION {}".format(table, ", ".join(old))
+        )
+        logging.info("MIGRATE: Dropped %s", ", ".join(old))
+    cursor.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db_interface import MariaDatabase
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    parser = argparse.ArgumentParser(description="Migrate the sensors table")
+    parser.add_argument("--config", default=None, help="json credentials file")
+    parser.add_argument("--months-ahead", type=int, default=3)
+    parser.add_argument("--drop-before", default=None, help="YYYY-MM, retention")
+    args = parser.parse_args()
+
+    db = MariaDatabase([], args.config)
+    db.open_db()
+    try:
+        version = migrate(db.connection, db.db_table)
+        logging.info("MIGRATE: Schema version %s", version)
+        if version >= 2:
+            add_partitions(db.connection, db.db_table, args.months_ahead)
+            if args.drop_before:
+                drop_partitions(
+                    db.connection,
+                    db.db_table,
+                    datetime.strptime(args.drop_before, "%Y-%m"),
+                )
+    finally:
+        db.close_db()
+        db.close_pool()
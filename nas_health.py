@@ -0,0 +1,139 @@
+import sys
+import time
+import logging
+import threading
+import subprocess
+
+"""Health of the NAS share the file sinks write to.
+
+On a hard mounted NFS share that stops answering, os.path.exists() and
+every other file call blocks until the share returns, which can be forever.
+MountHealth makes the check in a worker process instead, the caller waits at
+most timeout seconds and a probe that hangs is left behind. The result is
+kept for ttl seconds so the share is not probed on every write.
+
+A share can also stop answering between probes, while a file is written.
+DataMgr makes every file sink write with BoundedCall, a daemon thread the
+caller waits for at most a timeout. A write that hangs is left behind and
+the sink is skipped until it returns, the caller and the measurement loop
+keep running.
+
+While the share is down DataMgr keeps the entries of the file sinks queued
+in its spool, a file on local disk. When the share is back the queue is
+drained in chunks, one buffered write per chunk."""
+
+
+# Run by a new interpreter, -I -S keeps its start to tens of milliseconds
+PROBE = "import os, sys; sys.exit(0 if os.path.exists(sys.argv[1]) else 1)"
+
+
+class MountHealth:
+    """
+    path: file or directory on the share, the share is up if it exists
+    timeout: seconds to wait for the probe
+    ttl: seconds a result is used before probing again
+    """
+
+    def __init__(self, path, timeout=2.0, ttl=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.ttl = ttl
+
+        self.up = None
+        self.checked = None
+        # Probe that did not answer in time, no new probe while it is alive
+        self.hung = None
+
+    def is_up(self):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.ttl:
+            return self.up
+
+        up = self._probe()
+        if up != self.up:
+            if up:
+                logging.info("NAS: %s is up", self.path)
+            else:
+                logging.warning("NAS: %s is down", self.path)
+        self.up = up
+        self.checked = time.monotonic()
+        return up
+
+    """
+    The probe is a new interpreter, not a fork of the station: DataMgr runs
+    threads, and a forked copy could inherit a lock another thread holds.
+    multiprocessing spawn would import the station's main module again.
+    """
+
+    def _probe(self):
+        if self.hung is not None:
+            if self.hung.poll() is None:
+                logging.warning("NAS: Probe of %s still blocked", self.path)
+                return False
+            self.hung = None
+
+        try:
+            worker = subprocess.Popen(
+                [sys.executable, "-I", "-S", "-c", PROBE, self.path],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            logging.warning("NAS: Probe of %s not started: %s", self.path, e)
+            return False
+
+        try:
+            return worker.wait(self.timeout) == 0
+        except subprocess.TimeoutExpired:
+            pass
+
+        logging.warning(
+            "NAS: %s did not answer in %.01f s", self.path, self.timeout
+        )
+        # A process blocked in the kernel on NFS may not die until the share
+        # answers, it is reaped by a later probe
+        worker.kill()
+        self.hung = worker
+        return False
+
+
+class BoundedCall:
+    """
+    Runs function in a daemon thread, wait() returns False if it did not
+    finish in time. A daemon thread blocked on the share does not hold up
+    the program when it exits.
+    """
+
+    def __init__(self, function, name):
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._run, args=(function,), name=name, daemon=True
+        )
+        self.thread.start()
+
+    def _run(self, function):
+        try:
+            function()
+        except Exception as e:
+            self.error = e
+
+    def wait(self, timeout):
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    # Raises the error of the finished function, if any
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+
+if __name__ == "__main__":
+    import sys
+
+    health = MountHealth(sys.argv[1] if len(sys.argv) > 1 else "/mnt/NAS/Weather_data")
+    start = time.monotonic()
+    print("up" if health.is_up() else "down", "{:.03f} s".format(time.monotonic() - start))
@@ -0,0 +1,165 @@
+import os
+import logging
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from errors import ErrorNetworkIssue
+from columnar_interface import epoch_seconds, TIME_COLUMNS, DIRECTION_COLUMNS
+
+"""Parquet storage, a dataset of Hive style date partitions:
+
+    parquet_config/date=2021-06-01/part-1622505881-1622591981.parquet
+
+Partitions are UTC days. Each send_data() writes the entries of one day as
+one file with one row group, first to a hidden temp file which is renamed
+into place, so a reader never sees a partial file. A file is named after the
+times of its first and last records, writing the same entries again after a
+crash replaces the file instead of duplicating them.
+
+DataMgr keeps entries in the spool until a day is complete or row_group_size
+entries are queued, see ready(). read_range() reads only the partitions and
+columns a query needs."""
+
+PARTITION = "date"
+PARTITION_FORMAT = "%Y-%m-%d"
+
+
+# UTC day of a record time, as used in partition directory names
+def partition_date(value):
+    return datetime.fromtimestamp(epoch_seconds(value), timezone.utc).strftime(
+        PARTITION_FORMAT
+    )
+
+
+def column_type(name):
+    if name in TIME_COLUMNS:
+        return pa.timestamp("s", tz="UTC")
+    if name in DIRECTION_COLUMNS:
+        return pa.string()
+    return pa.float32()
+
+
+"""
+Reads columns of records from first_date to last_date, both UTC dates as
+"YYYY-MM-DD" and both included, into a pyarrow Table. None reads all
+columns or dates.
+"""
+
+
+def read_range(parquet_config, first_date=None, last_date=None, columns=None):
+    dataset = ds.dataset(parquet_config, format="parquet", partitioning="hive")
+    selected = None
+    if first_date is not None:
+        selected = ds.field(PARTITION) >= first_date
+    if last_date is not None:
+        last = ds.field(PARTITION) <= last_date
+        selected = last if selected is None else selected & last
+    return dataset.to_table(columns=columns, filter=selected)
+
+
+class ParquetDatabase:
+    """
+    column_names: record columns
+    parquet_config: dataset directory, created if missing
+    row_group_size: entries written together when a day is not yet complete,
+        288 is one day of 5 minute records
+    """
+
+    def __init__(self, column_names, parquet_config, row_group_size=288):
+        self.field_names = column_names
+        self.parquet_dir = parquet_config
+        self.row_group_size = row_group_size
+
+        self.schema = pa.schema(
+            [(name, column_type(name)) for name in self.field_names]
+        )
+        self.time_index = [
+            index for index, name in enumerate(self.field_names) if name in TIME_COLUMNS
+        ][0]
+
+        os.makedirs(self.parquet_dir, exist_ok=True)
+
+    """
+    Opens DB connection and connects cursor. In the event of a network issue,
+    a ErrorNetworkIssue is thrown.
+    """
+
+    def open_db(self):
+        if not os.path.isdir(self.parquet_dir):
+            logging.warning("PARQUET: %s not found", self.parquet_dir)
+            raise ErrorNetworkIssue
+
+    """
+    Returns number of entries at the front of entries that should be written
+    now, 0 to wait for more. Entries of a day are written once a later day
+    starts, once there are row_group_size of them, or at once with flush.
+    Never spans two partitions.
+    """
+
+    def ready(self, entries, flush=False):
+        if not entries:
+            return 0
+        first = partition_date(entries[0][self.time_index])
+        count = 0
+        for entry in entries:
+            if partition_date(entry[self.time_index]) != first:
+                return count
+            count += 1
+        if flush or count >= self.row_group_size:
+            return min(count, self.row_group_size)
+        return 0
+
+    def _table(self, entries):
+        arrays = []
+        for index, field in enumerate(self.schema):
+            values = [entry[index] for entry in entries]
+            if field.name in TIME_COLUMNS:
+                values = [epoch_seconds(value) for value in values]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    """
+    send_data requires connection to DB before calling this function.
+    Also, routine does not close connection.
+    With multi_entry, entry is a list of entries, all in one partition.
+    """
+
+    def send_data(self, entry, multi_entry=False):
+        entries = entry if multi_entry else [entry]
+        first = epoch_seconds(entries[0][self.time_index])
+        last = epoch_seconds(entries[-1][self.time_index])
+        directory = os.path.join(
+            self.parquet_dir, "{}={}".format(PARTITION, partition_date(first))
+        )
+        name = "part-{}-{}.parquet".format(first, last)
+        temp_name = os.path.join(directory, "." + name + ".tmp")
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            pq.write_table(
+                self._table(entries), temp_name, row_group_size=len(entries)
+            )
+            with open(temp_name, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(temp_name, os.path.join(directory, name))
+        except OSError as e:
+            logging.warning("PARQUET: Write %s failed: %s", name, e)
+            raise ErrorNetworkIssue
+        logging.debug("PARQUET: Wrote %s entries to %s", len(entries), name)
+
+    # Nothing is held open between writes
+    def close_db(self):
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+
+    # e.g. python3 parquet_interface.py /mnt/NAS/Weather_data/parquet 2021-06-01 2021-06-30
+    table = read_range(sys.argv[1], *sys.argv[2:4], columns=["time", "temp", "rain"])
+    print("{} records".format(table.num_rows))
+    if table.num_rows:
+        print(table.slice(0, 5))
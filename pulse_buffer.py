@@ -0,0 +1,107 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+"""Anemometer pulse timestamps and the wind statistics computed from them.
+
+PulseRingBuffer stores the monotonic time, in ns, of every anemometer pulse in
+a preallocated int64 array. record() is called from the GPIO interrupt
+thread, it only writes one array element so it never allocates.
+
+wind_statistics() works on the timestamps of a whole measurement window with
+NumPy. Speeds are running 3 second means sampled 4 times a second, as the
+WMO defines gust (max) and lull (min)."""
+
+GUST_SECONDS = 3.0
+GUST_STEP_SECONDS = 0.25
+
+# Speed histogram bins, km/hr
+HISTOGRAM_BINS = np.arange(0.0, 205.0, 5.0)
+
+NS_IN_SEC = 1000000000
+
+WindStats = namedtuple(
+    "WindStats", ["mean", "gust", "lull", "current", "histogram", "pulses"]
+)
+
+
+class PulseRingBuffer:
+    """
+    capacity: number of timestamps kept, oldest are overwritten.
+    65536 holds over 5 minutes of pulses at 200 km/hr.
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        # Index of next write and number of pulses ever recorded
+        self.head = 0
+        self.total = 0
+
+    # Interrupt handler, store one timestamp
+    def record(self, timestamp_ns):
+        self.timestamps[self.head] = timestamp_ns
+        head = self.head + 1
+        self.head = 0 if head == self.capacity else head
+        self.total += 1
+
+    """
+    Returns sorted copy of timestamps in [start_ns, end_ns). Pulses recorded
+    while copying are left for the next window.
+    """
+
+    def window(self, start_ns, end_ns):
+        head = self.head
+        total = self.total
+        if total < self.capacity:
+            ordered = self.timestamps[:head].copy()
+        else:
+            ordered = np.concatenate(
+                (self.timestamps[head:], self.timestamps[:head])
+            )
+
+        first = np.searchsorted(ordered, start_ns, side="left")
+        last = np.searchsorted(ordered, end_ns, side="left")
+        if total > self.capacity and ordered[0] > start_ns:
+            logging.warning("PULSE: Buffer overrun, window starts late")
+        return ordered[first:last]
+
+
+"""
+timestamps_ns: sorted pulse times in the window
+start_ns, end_ns: window limits
+kmh_per_hz: wind speed for one pulse per second
+"""
+
+
+def wind_statistics(timestamps_ns, start_ns, end_ns, kmh_per_hz):
+    duration = (end_ns - start_ns) / NS_IN_SEC
+    pulses = len(timestamps_ns)
+    mean = pulses / duration * kmh_per_hz if duration > 0 else 0.0
+
+    # Running 3 second window ending at each 0.25 second step
+    gust_ns = int(GUST_SECONDS * NS_IN_SEC)
+    step_ns = int(GUST_STEP_SECONDS * NS_IN_SEC)
+    ends = np.arange(start_ns + gust_ns, end_ns + 1, step_ns, dtype=np.int64)
+    if len(ends):
+        counts = np.searchsorted(timestamps_ns, ends, side="left") - np.searchsorted(
+            timestamps_ns, ends - gust_ns, side="left"
+        )
+        speeds = counts * (kmh_per_hz / GUST_SECONDS)
+        gust = float(speeds.max())
+        lull = float(speeds.min())
+        histogram = np.histogram(speeds, bins=HISTOGRAM_BINS)[0]
+    else:
+        # Window shorter than 3 seconds
+        gust = lull = mean
+        histogram = np.histogram([mean], bins=HISTOGRAM_BINS)[0]
+
+    # Speed from the last interval between two pulses
+    if pulses > 1:
+        interval = (timestamps_ns[-1] - timestamps_ns[-2]) / NS_IN_SEC
+        current = kmh_per_hz / interval
+    else:
+        current = 0.0
+
+    return WindStats(mean, gust, lull, current, histogram, pulses)
@@ -0,0 +1,230 @@
+import logging
+from datetime import datetime, timedelta
+
+"""Hourly, daily and monthly rollups of the sensors table, see
+Maria/SQL/addrollups.sql.
+
+Each rollup row is one bucket of one station with, per measurement, min,
+max, sum and count of the non NULL values, mean is sum / count. Tables
+before schema version 2 have no station_id, their rows are station 1, see
+migrate.py.
+
+Buckets are always computed from the sensors table, never added to, so a
+row inserted twice is counted as often as it is stored. When WS_ROLLUPS is
+set MariaDatabase.send_data() recomputes the buckets of the inserted
+entries in the same transaction as the insert.
+
+rebuild() recomputes the buckets of a time range, for backfills or after
+rows were changed by hand:
+
+    python3 rollups.py --config json_backend_private.load --first 2021-06-01"""
+
+# Measurements rolled up, columns <name>_min, _max, _sum, _count
+MEASUREMENTS = ["ws_ave", "ws_max", "humid", "press", "temp", "therm", "rain"]
+
+TIME_COLUMN = "time"
+STATION_COLUMN = "station_id"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Start of the month after t
+def _next_month(t):
+    if t.month == 12:
+        return t.replace(year=t.year + 1, month=1)
+    return t.replace(month=t.month + 1)
+
+
+# Level to (table, bucket of a datetime, next bucket, SQL bucket of time)
+LEVELS = {
+    "hourly": (
+        "sensors_hourly",
+        lambda t: t.replace(minute=0, second=0, microsecond=0),
+        lambda bucket: bucket + timedelta(hours=1),
+        "DATE_FORMAT(`time`, '%Y-%m-%d %H:00:00')",
+    ),
+    "daily": (
+        "sensors_daily",
+        lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0),
+        lambda bucket: bucket + timedelta(days=1),
+        "DATE(`time`)",
+    ),
+    "monthly": (
+        "sensors_monthly",
+        lambda t: t.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+        _next_month,
+        "DATE_FORMAT(`time`, '%Y-%m-01')",
+    ),
+}
+
+
+def _aggregate_columns(measurements):
+    columns = []
+    for name in measurements:
+        columns += [name + "_min", name + "_max", name + "_sum", name + "_count"]
+    return columns
+
+
+def _aggregates(measurements):
+    aggregates = []
+    for name in measurements:
+        aggregates += [
+            "MIN({})".format(name),
+            "MAX({})".format(name),
+            "COALESCE(SUM({}), 0)".format(name),
+            "COUNT({})".format(name),
+        ]
+    return aggregates
+
+
+# True if table has the station_id column of schema version 2
+def station_column(cursor, table):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, STATION_COLUMN),
+    )
+    return cursor.fetchone()[0] > 0
+
+
+"""
+Recomputes the level's buckets from lower up to, not including, upper,
+bucket datetimes or None for no limit, from the rows of table. Returns the
+number of buckets written, caller commits.
+"""
+
+
+def rebuild_buckets(cursor, table, level, lower=None, upper=None, has_station=False):
+    rollup_table, _, _, bucket_sql = LEVELS[level]
+    rows_where = []
+    buckets_where = []
+    parameters = []
+    if lower is not None:
+        rows_where.append("`time` >= %s")
+        buckets_where.append("bucket >= %s")
+        parameters.append(lower.strftime(TIME_FORMAT))
+    if upper is not None:
+        rows_where.append("`time` < %s")
+        buckets_where.append("bucket < %s")
+        parameters.append(upper.strftime(TIME_FORMAT))
+
+    cursor.execute(
+        "DELETE FROM {}{}".format(rollup_table, _where(buckets_where)), parameters
+    )
+    cursor.execute(
+        "INSERT INTO {} ({}, bucket, samples, {}) SELECT {}, {}, COUNT(*), {} "
+        "FROM {}{} GROUP BY 1, 2".format(
+            rollup_table,
+            STATION_COLUMN,
+            ", ".join(_aggregate_columns(MEASUREMENTS)),
+            STATION_COLUMN if has_station else "1",
+            bucket_sql,
+            ", ".join(_aggregates(MEASUREMENTS)),
+            table,
+            _where(rows_where),
+        ),
+        parameters,
+    )
+    return cursor.rowcount
+
+
+class Rollups:
+    """
+    column_names: columns of the entries passed to update(), must include
+    time
+    table: table the entries are inserted into
+    """
+
+    def __init__(self, column_names, table="sensors"):
+        self.time_index = column_names.index(TIME_COLUMN)
+        self.table = table
+        # Set from the table schema by MariaDatabase, see station_column()
+        self.has_station = False
+
+    def _time(self, value):
+        if isinstance(value, datetime):
+            return value
+        return datetime.strptime(value, TIME_FORMAT)
+
+    # Recomputes every bucket the entries fall in, caller commits
+    def update(self, cursor, entries):
+        times = [
+            self._time(entry[self.time_index])
+            for entry in entries
+            if entry[self.time_index] is not None
+        ]
+        if not times:
+            return
+        for level, (_, bucket_of, next_bucket, _) in LEVELS.items():
+            rebuild_buckets(
+                cursor,
+                self.table,
+                level,
+                bucket_of(min(times)),
+                next_bucket(bucket_of(max(times))),
+                self.has_station,
+            )
+
+
+"""
+Recomputes the buckets from first up to the end of the day of last,
+datetimes or None for all rows, from the sensors table. The range is
+widened to whole hours, days and months. Runs in one transaction.
+"""
+
+
+def rebuild(connection, table="sensors", first=None, last=None):
+    # Exclusive end of the range, the day after last
+    end = None
+    if last is not None:
+        end = last.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    cursor = connection.cursor()
+    try:
+        has_station = station_column(cursor, table)
+        for level, (rollup_table, bucket_of, next_bucket, _) in LEVELS.items():
+            lower = bucket_of(first) if first is not None else None
+            upper = None
+            if end is not None:
+                # end rounded up to a bucket boundary
+                upper = bucket_of(end)
+                if upper < end:
+                    upper = next_bucket(upper)
+            count = rebuild_buckets(cursor, table, level, lower, upper, has_station)
+            logging.info("ROLLUP: %s rebuilt, %s buckets", rollup_table, count)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _where(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db_interface import MariaDatabase
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    parser = argparse.ArgumentParser(description="Rebuild sensors rollup tables")
+    parser.add_argument("--config", default=None, help="json credentials file")
+    parser.add_argument("--first", default=None, help="first day, YYYY-MM-DD")
+    parser.add_argument("--last", default=None, help="last day, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    day = lambda value: datetime.strptime(value, "%Y-%m-%d") if value else None
+    db = MariaDatabase([], args.config)
+    db.open_db()
+    try:
+        rebuild(
+            db.connection,
+            db.db_table,
+            day(args.first),
+            day(args.last),
+        )
+    finally:
+        db.close_db()
+        db.close_pool()
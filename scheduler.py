@@ -0,0 +1,73 @@
+import time
+import logging
+
+"""Scheduler wakes the measurement loop at absolute deadlines on the
+monotonic clock. Deadlines are computed as start + n * period, so time spent
+reading sensors or writing data is made up by a shorter wait instead of
+pushing every later measurement back. While waiting the thread sleeps once
+until the deadline rather than polling.
+
+clock can be any object with monotonic(), time() and sleep(), the time
+module is used by default."""
+
+
+class Scheduler:
+    def __init__(self, clock=time):
+        self.clock = clock
+
+        # Jitter is how late, in seconds, a wake up was versus its deadline
+        self.jitter_count = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.last_jitter = 0.0
+
+    # Converts a time.time() value to a deadline on the monotonic clock
+    def deadline_at(self, wall_time):
+        return self.clock.monotonic() + (wall_time - self.clock.time())
+
+    # Converts a monotonic deadline back to time.time(), for logs and timestamps
+    def wall_time(self, deadline):
+        return self.clock.time() + (deadline - self.clock.monotonic())
+
+    """
+    Sleeps until deadline, a value of clock.monotonic(). Returns the jitter,
+    how many seconds after the deadline the call returned.
+    """
+
+    def wait_until(self, deadline):
+        remaining = deadline - self.clock.monotonic()
+        while remaining > 0:
+            self.clock.sleep(remaining)
+            remaining = deadline - self.clock.monotonic()
+
+        jitter = -remaining
+        self.last_jitter = jitter
+        self.jitter_count += 1
+        self.jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        return jitter
+
+    """
+    Returns deadline + period. If that is not in the future the missed
+    periods are skipped, the result is the first deadline on the original
+    grid after clock.monotonic().
+    """
+
+    def next_deadline(self, deadline, period):
+        deadline += period
+        late = self.clock.monotonic() - deadline
+        if late >= 0:
+            missed = int(late // period) + 1
+            logging.warning("SCHED: Skipped %s missed periods", missed)
+            deadline += missed * period
+        return deadline
+
+    def jitter_mean(self):
+        if self.jitter_count == 0:
+            return 0.0
+        return self.jitter_total / self.jitter_count
+
+    def reset_jitter(self):
+        self.jitter_count = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
@@ -0,0 +1,392 @@
+import os
+import math
+import heapq
+import asyncio
+import selectors
+import random
+import sqlite3
+import tempfile
+import threading
+from collections import namedtuple
+
+"""Simulated weather station hardware, selected with WS_HARDWARE=sim
+(see hardware.py). Provides stand-ins for gpiozero Button and MCP3008,
+smbus2/bme280 and the DS18B20 1-Wire files, all driven by scripted weather
+and a simulated clock.
+
+SimClock is a discrete event clock, sleep() returns at once and moves the
+simulated time forward, firing anemometer and rain gauge pulses on the way.
+A 24 hour run takes seconds. The clock is meant to be slept on by one
+thread, the measurement loop, or driven by SimEventLoop for the asyncio
+station."""
+
+# Pin numbers as wired in jim_weather_station.py
+WIND_SPEED_PIN = 5
+RAIN_PIN = 6
+
+# km/hr for one anemometer pulse per second, see WindSpeedDirThread
+KMH_PER_HZ = (2 * math.pi * 9.0) / 100000.0 / 2.0 * 3600 * 1.18
+BUCKET_SIZE = 0.2794
+
+# Vane voltages from wind_direction.WindDirection, in compass order
+VANE_VOLTS = [
+    0.4, 1.4, 1.2, 2.8, 2.7, 2.9, 2.2, 2.5, 1.8, 2.0, 0.7, 0.8, 0.1, 0.3, 0.2, 0.6,
+]
+VANE_REF = 3.29
+
+# Simulated time starts at 2021-06-01 00:00:00 UTC
+SIM_START = 1622505600.0
+
+
+class SimClock:
+    """Drop-in for the parts of the time module the station uses."""
+
+    def __init__(self, start=SIM_START):
+        self.start = start
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return int(self.now * 1e9)
+
+    def time(self):
+        return self.start + self.now
+
+    def perf_counter(self):
+        return self.now
+
+    # Schedules callback() at simulated monotonic time when
+    def call_at(self, when, callback):
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.events, (when, self.sequence, callback))
+
+    # Calls callback() every period seconds, starting one period from now
+    def call_every(self, period, callback):
+        def tick():
+            callback()
+            self.call_at(self.now + period, tick)
+
+        self.call_at(self.now + period, tick)
+
+    # As hardware.PiClock.sample_every(), calls are clock events, no thread
+    def sample_every(self, period, callback, stop_event):
+        def sample(when):
+            if not stop_event.is_set():
+                callback()
+                self.call_at(when + period, lambda: sample(when + period))
+
+        self.call_at(self.now, lambda: sample(self.now))
+        return None
+
+    def sleep(self, seconds):
+        self.advance(self.now + max(seconds, 0.0))
+
+    # Fires every event up to target time, then sets clock to target
+    def advance(self, target):
+        while self.events and self.events[0][0] <= target:
+            with self.lock:
+                when, _, callback = heapq.heappop(self.events)
+            self.now = max(self.now, when)
+            callback()
+        self.now = max(self.now, target)
+
+
+class SimSelector:
+    """
+    Selector of SimEventLoop. Waiting for the next timer advances the
+    simulated clock instead of blocking. While an executor job is running the
+    wait is real, so a sensor read in a thread takes no simulated time and is
+    not timed out by a clock that jumped ahead.
+    """
+
+    def __init__(self, loop, clock):
+        self.loop = loop
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        if self.loop.executor_jobs or timeout is None:
+            return self.selector.select(timeout)
+        self.clock.advance(self.clock.monotonic() + timeout)
+        return self.selector.select(0)
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class SimEventLoop(asyncio.SelectorEventLoop):
+    """asyncio event loop whose time is SimClock.monotonic()."""
+
+    def __init__(self, clock):
+        self.sim_clock = clock
+        self.executor_jobs = 0
+        super().__init__(SimSelector(self, clock))
+
+    def time(self):
+        return self.sim_clock.monotonic()
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.executor_jobs += 1
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, future):
+        self.executor_jobs -= 1
+
+
+class SimWeather:
+    """
+    Scripted weather, all values are functions of simulated time in seconds.
+    wind_kmh: mean wind speed, gusting around it
+    rain_mm_hr: rain rate while it is raining, raining 1 hour in 6
+    """
+
+    def __init__(self, clock, seed=1, wind_kmh=15.0, rain_mm_hr=4.0):
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.wind_kmh = wind_kmh
+        self.rain_mm_hr = rain_mm_hr
+        self.gust = 0.0
+
+    def day_fraction(self):
+        return (self.clock.time() % 86400) / 86400.0
+
+    def wind_speed(self):
+        # Slow gust cycle plus noise, never below calm
+        t = self.clock.monotonic()
+        speed = self.wind_kmh * (1.0 + 0.4 * math.sin(2 * math.pi * t / 600.0))
+        self.gust = 0.8 * self.gust + 0.2 * self.random.gauss(0.0, self.wind_kmh * 0.3)
+        return max(speed + self.gust, 0.0)
+
+    def wind_direction(self):
+        # Veers slowly around the compass, with a little wobble
+        t = self.clock.monotonic()
+        heading = (t / 3600.0 * 22.5 + self.random.gauss(0.0, 10.0)) % 360.0
+        return int(round(heading / 22.5)) % 16
+
+    def rain_rate(self):
+        t = self.clock.monotonic()
+        return self.rain_mm_hr if (t // 3600) % 6 == 0 else 0.0
+
+    def temperature(self):
+        return 15.0 - 6.0 * math.cos(2 * math.pi * self.day_fraction())
+
+    def humidity(self):
+        return 70.0 + 15.0 * math.cos(2 * math.pi * self.day_fraction())
+
+    def pressure(self):
+        return 1013.0 + 4.0 * math.sin(2 * math.pi * self.clock.monotonic() / 172800)
+
+    def ground_temperature(self):
+        return 12.0 - 2.0 * math.cos(2 * math.pi * (self.day_fraction() - 0.1))
+
+
+class SimStation:
+    """Owns the clock, the weather script and the pulse trains."""
+
+    def __init__(self, clock=None, weather=None):
+        self.clock = clock if clock else SimClock()
+        self.weather = weather if weather else SimWeather(self.clock)
+        self.rates = {
+            WIND_SPEED_PIN: lambda: self.weather.wind_speed() / KMH_PER_HZ,
+            RAIN_PIN: lambda: self.weather.rain_rate() / BUCKET_SIZE / 3600.0,
+        }
+        self.w1_dir = None
+
+    """
+    Starts a pulse train on button. The pulse rate is re-read from the
+    weather script after every pulse, a rate of 0 is checked again after
+    one second.
+    """
+
+    def start_pulses(self, button):
+        rate_function = self.rates.get(button.pin)
+        if rate_function is None:
+            return
+
+        def pulse():
+            button.press()
+            schedule()
+
+        def schedule():
+            rate = rate_function()
+            if rate > 0:
+                self.clock.call_at(self.clock.now + 1.0 / rate, pulse)
+            else:
+                self.clock.call_at(self.clock.now + 1.0, schedule)
+
+        schedule()
+
+    """
+    Creates a 1-Wire device directory with one DS18B20 probe whose w1_slave
+    file is rewritten every minute of simulated time.
+    """
+
+    def w1_devices(self, probes=1):
+        if self.w1_dir:
+            return self.w1_dir
+        self.w1_dir = tempfile.mkdtemp(prefix="ws_sim_w1_")
+        files = []
+        for index in range(probes):
+            device = os.path.join(self.w1_dir, "28-00000000%04x" % (index + 1))
+            os.mkdir(device)
+            files.append(os.path.join(device, "w1_slave"))
+
+        def update():
+            for index, name in enumerate(files):
+                milli_c = int((self.weather.ground_temperature() + index * 0.5) * 1000)
+                with open(name, "w") as f:
+                    f.write("72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n")
+                    f.write("72 01 4b 46 7f ff 0e 10 57 t={}\n".format(milli_c))
+
+        update()
+        self.clock.call_every(60.0, update)
+        return self.w1_dir
+
+
+# Created by hardware.py when WS_HARDWARE=sim
+station = None
+
+
+def get_station():
+    global station
+    if station is None:
+        station = SimStation()
+    return station
+
+
+class SimButton:
+    """Stand-in for gpiozero.Button, pressed by the simulated pulse trains."""
+
+    def __init__(self, pin, **kwargs):
+        self.pin = pin
+        self.when_activated = None
+        self.when_pressed = None
+        get_station().start_pulses(self)
+
+    def press(self):
+        if self.when_activated:
+            self.when_activated()
+        if self.when_pressed:
+            self.when_pressed()
+
+
+class SimMCP3008:
+    """Stand-in for gpiozero.MCP3008 reading the wind vane."""
+
+    def __init__(self, channel=0, **kwargs):
+        self.channel = channel
+
+    @property
+    def value(self):
+        return VANE_VOLTS[get_station().weather.wind_direction()] / VANE_REF
+
+    @property
+    def raw_value(self):
+        return int(round(self.value * 1023))
+
+    def close(self):
+        pass
+
+
+class SimSMBus:
+    """Stand-in for smbus2.SMBus with a BME280 at 0x77."""
+
+    def __init__(self, port):
+        self.port = port
+        self.registers = {}
+
+    def read_byte_data(self, address, register):
+        if address != 0x77:
+            raise OSError(121, "Remote I/O error")
+        # BME280 chip ID
+        return 0x60 if register == 0xD0 else self.registers.get(register, 0)
+
+    def write_byte_data(self, address, register, value):
+        if address != 0x77:
+            raise OSError(121, "Remote I/O error")
+        self.registers[register] = value
+
+    def close(self):
+        pass
+
+
+class SimBME280:
+    """Stand-in for the RPi.bme280 module."""
+
+    Sample = namedtuple("Sample", ["timestamp", "temperature", "pressure", "humidity"])
+    oversampling = namedtuple("oversampling", ["x1", "x2", "x4", "x8", "x16"])(
+        1, 2, 3, 4, 5
+    )
+
+    def load_calibration_params(self, bus, address):
+        bus.read_byte_data(address, 0x88)
+        return {}
+
+    def sample(self, bus, address, compensation_params=None, sampling=None):
+        bus.read_byte_data(address, 0xF7)
+        station = get_station()
+        return self.Sample(
+            station.clock.time(),
+            station.weather.temperature(),
+            station.weather.pressure(),
+            station.weather.humidity(),
+        )
+
+
+class SimMariaDatabase:
+    """
+    Local stand-in for db_interface.MariaDatabase, keeps rows in SQLite.
+    db_config: SQLite file name, in memory if None
+    """
+
+    def __init__(self, column_names, db_config=None):
+        self.column_names = column_names
+        self.db_file = db_config if db_config else ":memory:"
+        self.db_table = "sensors"
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.cursor = None
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS {0} (id INTEGER PRIMARY KEY, {1})".format(
+                self.db_table, ", ".join(self.column_names)
+            )
+        )
+        self.db_write_cmd = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+            self.db_table,
+            ", ".join(self.column_names),
+            ", ".join(["?"] * len(self.column_names)),
+        )
+
+    def open_db(self):
+        self.cursor = self.connection.cursor()
+
+    def send_data(self, entry, multi_entry=False):
+        if multi_entry:
+            entries = [entry] if type(entry) is tuple else entry
+            self.cursor.executemany(self.db_write_cmd, entries)
+        else:
+            self.cursor.execute(self.db_write_cmd, entry)
+        self.connection.commit()
+
+    def close_db(self):
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+
+    def close_pool(self):
+        self.close_db()
+
+    def is_connected_db(self):
+        return True
+
+    def row_count(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM {0}".format(self.db_table)
+        ).fetchone()[0]
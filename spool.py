@@ -0,0 +1,288 @@
+import os
+import time
+import json
+import logging
+import threading
+
+"""Spool is the FIFO between the weather station and its data sinks.
+Each sink (MariaDB, CSV, flat file) reads the spool through its own cursor,
+so one sink can fall behind during an outage while the others keep up.
+Entries are read with peek() and only removed with advance() once the sink
+has stored them.
+
+SpoolFile keeps the entries in an append-only file of json lines, so queued
+data survives a restart or power cut and a long outage does not grow memory.
+MemorySpool has the same interface and is used when no spool file is set."""
+
+
+# Makes a rename in the directory of file_name durable, where supported
+def _fsync_directory(file_name):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SpoolCursor:
+    """Read position of one sink in a spool."""
+
+    def __init__(self, spool, name):
+        self.spool = spool
+        self.name = name
+
+    def __len__(self):
+        return self.spool.pending(self.name)
+
+    # Returns up to count of the oldest entries not yet stored by this sink
+    def peek(self, count):
+        return self.spool.peek(self.name, count)
+
+    # Marks count entries returned by peek() as stored by this sink
+    def advance(self, count):
+        self.spool.advance(self.name, count)
+
+
+class MemorySpool:
+    """In memory spool, entries are lost if the program stops."""
+
+    def __init__(self, sinks):
+        self.lock = threading.Lock()
+        self.entries = []
+        # Index into entries of first entry removed from the front of list
+        self.base = 0
+        self.positions = {name: 0 for name in sinks}
+
+    def cursor(self, name):
+        return SpoolCursor(self, name)
+
+    def append(self, entry):
+        # Without sinks nobody would ever remove the entry
+        if not self.positions:
+            return
+        with self.lock:
+            self.entries.append(entry)
+
+    def pending(self, name):
+        with self.lock:
+            return self.base + len(self.entries) - self.positions[name]
+
+    def peek(self, name, count):
+        with self.lock:
+            start = self.positions[name] - self.base
+            return self.entries[start : start + count]
+
+    def advance(self, name, count):
+        if count <= 0:
+            return
+        with self.lock:
+            self.positions[name] += count
+            self._compact()
+
+    # Drop entries every cursor has passed once they are half of the list,
+    # keeps removal from the front of the list O(1) amortized
+    def _compact(self):
+        done = min(self.positions.values(), default=self.base + len(self.entries))
+        drop = done - self.base
+        if drop > 0 and drop * 2 >= len(self.entries):
+            del self.entries[:drop]
+            self.base = done
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SpoolFile:
+    """
+    spool_file: name of append-only spool file, cursors are kept in
+        spool_file + ".cursors"
+    sinks: names of sinks reading the spool
+    fsync_batch: maximum number of appended entries not yet fsync'ed
+    fsync_interval: in seconds, an append fsync's the file when the last
+        fsync is older than this
+    """
+
+    def __init__(self, spool_file, sinks, fsync_batch=16, fsync_interval=1.0):
+        self.spool_file_name = spool_file
+        self.cursor_file_name = spool_file + ".cursors"
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        self.lock = threading.Lock()
+
+        # Number of entries and size of spool file
+        self.count = 0
+        self.size = 0
+
+        # Cursor position per sink, as [byte offset, entry index]
+        self.positions = {}
+
+        # Byte offsets following each entry returned by last peek() per sink
+        self.peeked = {name: [] for name in sinks}
+        self.readers = {}
+
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+        self._replay()
+
+        for name in sinks:
+            if name not in self.positions:
+                # New sink starts at end of spool, old entries are not its data
+                self.positions[name] = [self.size, self.count]
+            self.readers[name] = open(self.spool_file_name, "rb")
+        # Sinks no longer configured must not hold up compaction
+        self.positions = {name: self.positions[name] for name in sinks}
+        self._write_cursors()
+
+        self.writer = open(self.spool_file_name, "ab")
+
+        for name in sinks:
+            queued = self.pending(name)
+            if queued > 0:
+                logging.warning("SPOOL: Replayed %s entries for %s", queued, name)
+
+    """
+    Reads spool file once at start up to count entries. A partly written last
+    line, from a power cut during append(), is truncated. Cursors that point
+    past the end of the file are moved to the end.
+    """
+
+    def _replay(self):
+        if os.path.exists(self.spool_file_name):
+            with open(self.spool_file_name, "r+b") as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        logging.warning("SPOOL: Truncating partial entry")
+                        break
+                    offset += len(line)
+                    self.count += 1
+                f.truncate(offset)
+            self.size = offset
+        else:
+            open(self.spool_file_name, "ab").close()
+
+        if os.path.exists(self.cursor_file_name):
+            with open(self.cursor_file_name, "r") as f:
+                try:
+                    self.positions = json.load(f)
+                except ValueError as e:
+                    # Entries are sent again, safer than not starting at all
+                    logging.warning("SPOOL: Bad cursor file, resending spool: %s", e)
+                    self.positions = {name: [0, 0] for name in self.peeked}
+
+        for name, position in self.positions.items():
+            if position[0] > self.size or position[1] > self.count:
+                self.positions[name] = [self.size, self.count]
+
+    # Cursors are replaced atomically, a crash never leaves a partial file.
+    # The file is fsync'ed before the rename and the directory after it, or
+    # a power cut can leave an empty cursor file
+    def _write_cursors(self):
+        temp_name = self.cursor_file_name + ".tmp"
+        with open(temp_name, "w") as f:
+            json.dump(self.positions, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, self.cursor_file_name)
+        _fsync_directory(self.cursor_file_name)
+
+    def cursor(self, name):
+        return SpoolCursor(self, name)
+
+    def append(self, entry):
+        if not self.positions:
+            return
+        line = json.dumps(list(entry)).encode() + b"\n"
+        with self.lock:
+            self.writer.write(line)
+            self.writer.flush()
+            self.size += len(line)
+            self.count += 1
+            self.unsynced += 1
+
+            now = time.monotonic()
+            if (
+                self.unsynced >= self.fsync_batch
+                or now - self.last_sync >= self.fsync_interval
+            ):
+                self._sync(now)
+
+    def _sync(self, now):
+        os.fsync(self.writer.fileno())
+        self.unsynced = 0
+        self.last_sync = now
+
+    def sync(self):
+        with self.lock:
+            if self.unsynced:
+                self._sync(time.monotonic())
+
+    def pending(self, name):
+        with self.lock:
+            return self.count - self.positions[name][1]
+
+    def peek(self, name, count):
+        with self.lock:
+            reader = self.readers[name]
+            offset = self.positions[name][0]
+            reader.seek(offset)
+
+            entries = []
+            offsets = []
+            while len(entries) < count and offset < self.size:
+                line = reader.readline()
+                offset += len(line)
+                entries.append(tuple(json.loads(line)))
+                offsets.append(offset)
+
+            self.peeked[name] = offsets
+            return entries
+
+    def advance(self, name, count):
+        if count <= 0:
+            return
+        with self.lock:
+            offsets = self.peeked[name]
+            self.positions[name] = [
+                offsets[count - 1],
+                self.positions[name][1] + count,
+            ]
+            self.peeked[name] = offsets[count:]
+            self._compact()
+            self._write_cursors()
+
+    # Spool file is emptied when every sink has read all entries
+    def _compact(self):
+        if self.size == 0:
+            return
+        for position in self.positions.values():
+            if position[0] < self.size:
+                return
+
+        # Truncate before cursors are reset, a crash in between leaves
+        # cursors past the end of file which _replay() corrects
+        self.writer.truncate(0)
+        os.fsync(self.writer.fileno())
+        self.unsynced = 0
+        self.size = 0
+        self.count = 0
+        for name in self.positions:
+            self.positions[name] = [0, 0]
+            self.peeked[name] = []
+
+    def close(self):
+        with self.lock:
+            self._sync(time.monotonic())
+            self.writer.close()
+            for reader in self.readers.values():
+                reader.close()
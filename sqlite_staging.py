@@ -0,0 +1,143 @@
+import logging
+import sqlite3
+import threading
+
+from spool import SpoolCursor
+
+"""SQLite staging store, a spool (see spool.py) kept in a local SQLite
+database in WAL mode.
+
+Every record is committed to the records table first, one column per
+record column, so it is durable on the Pi before any network is used.
+Each sink has a high-water mark, the id of the last record it stored, in
+the sink_marks table. Records are never removed, the table is also a local
+history that can be queried while the station runs, WAL lets other
+processes read while records are written:
+
+    sqlite3 weather_station.db "SELECT time, temp FROM records ORDER BY id DESC LIMIT 10"
+"""
+
+RECORDS = "records"
+MARKS = "sink_marks"
+
+
+class SqliteStaging:
+    """
+    staging_file: SQLite database file, created if missing
+    column_names: record columns, columns missing from an existing records
+        table are added
+    sinks: names of sinks reading the store
+    synchronous: SQLite synchronous pragma, FULL also survives a power cut
+    """
+
+    def __init__(self, staging_file, column_names, sinks, synchronous="FULL"):
+        self.staging_file = staging_file
+        self.column_names = column_names
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            staging_file, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous={}".format(synchronous))
+
+        columns = ", ".join('"{}"'.format(name) for name in column_names)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY AUTOINCREMENT, {})".format(
+                RECORDS, columns
+            )
+        )
+        existing = [
+            row[1]
+            for row in self.connection.execute("PRAGMA table_info({})".format(RECORDS))
+        ]
+        for name in column_names:
+            if name not in existing:
+                logging.info("STAGING: Adding column %s", name)
+                self.connection.execute(
+                    'ALTER TABLE {} ADD COLUMN "{}"'.format(RECORDS, name)
+                )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS {} (sink TEXT PRIMARY KEY, last_id INTEGER)".format(
+                MARKS
+            )
+        )
+
+        self.insert_sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            RECORDS, columns, ", ".join(["?"] * len(column_names))
+        )
+        self.select_sql = "SELECT id, {} FROM {} WHERE id > ? ORDER BY id LIMIT ?".format(
+            columns, RECORDS
+        )
+
+        # High-water mark per sink, a new sink starts after the last record
+        marks = dict(self.connection.execute("SELECT sink, last_id FROM " + MARKS))
+        last_id = self._last_id()
+        self.marks = {}
+        for name in sinks:
+            self.marks[name] = marks.get(name, last_id)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO {} VALUES (?, ?)".format(MARKS),
+                (name, self.marks[name]),
+            )
+        # Ids of records returned by last peek() per sink
+        self.peeked = {name: [] for name in sinks}
+
+        for name in sinks:
+            queued = self.pending(name)
+            if queued > 0:
+                logging.warning("STAGING: %s entries queued for %s", queued, name)
+
+    def _last_id(self):
+        row = self.connection.execute("SELECT MAX(id) FROM " + RECORDS).fetchone()
+        return row[0] or 0
+
+    def cursor(self, name):
+        return SpoolCursor(self, name)
+
+    # Commits entry, kept even without sinks as local history
+    def append(self, entry):
+        with self.lock:
+            self.connection.execute(self.insert_sql, tuple(entry))
+
+    def pending(self, name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*) FROM {} WHERE id > ?".format(RECORDS),
+                (self.marks[name],),
+            ).fetchone()
+            return row[0]
+
+    def peek(self, name, count):
+        with self.lock:
+            rows = self.connection.execute(
+                self.select_sql, (self.marks[name], count)
+            ).fetchall()
+        self.peeked[name] = [row[0] for row in rows]
+        return [tuple(row[1:]) for row in rows]
+
+    # Moves high-water mark past count entries returned by peek()
+    def advance(self, name, count):
+        if count <= 0:
+            return
+        ids = self.peeked[name]
+        with self.lock:
+            self.marks[name] = ids[count - 1]
+            self.connection.execute(
+                "UPDATE {} SET last_id = ? WHERE sink = ?".format(MARKS),
+                (self.marks[name], name),
+            )
+        self.peeked[name] = ids[count:]
+
+    # Read only query of the local history, e.g. for a display
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    # Every append is committed, nothing to sync
+    def sync(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
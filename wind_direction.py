@@ -3,49 +3,227 @@
 # Code adapted from the following in some instances:
 # @ https://projects.raspberrypi.org/en/projects/build-your-own-weather-station/7
 
-from gpiozero import MCP3008
+import time
+import math
 import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Compass points in order, point n is at n * 22.5 degrees. The index is the
+# direction code stored by columnar_interface and as w_dir_code in MariaDB.
+# hardware is imported where it is used, so storage and analysis modules
+# can import these without the Pi libraries
+COMPASS_POINTS = [
+    "N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+    "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW",
+]
+DEGREES_PER_POINT = 360.0 / len(COMPASS_POINTS)
+COMPASS_DEGREES = {
+    point: index * DEGREES_PER_POINT for index, point in enumerate(COMPASS_POINTS)
+}
+
+WindVector = namedtuple(
+    "WindVector",
+    ["mean_speed", "max_speed", "direction", "weighted_direction", "direction_std"],
+)
+
+
+# Vane output voltage for each compass point
+VANE_VOLTS = {
+    0.4: "N",
+    1.4: "NNE",
+    1.2: "NE",
+    2.8: "ENE",
+    2.7: "E",
+    2.9: "ESE",
+    2.2: "SE",
+    2.5: "SSE",
+    1.8: "S",
+    2.0: "SSW",
+    0.7: "SW",
+    0.8: "WSW",
+    0.1: "W",
+    0.3: "WNW",
+    0.2: "NW",
+    0.6: "NNW",
+}
+VANE_REFERENCE_VOLTS = 3.29
+ADC_CODES = 1024
+
+# Readings further than this from every vane voltage are not a direction,
+# e.g. vane disconnected. Half the widest gap between vane voltages is 0.2 V
+VANE_TOLERANCE_VOLTS = 0.25
+
+# Code returned by get_direction_code() for no direction
+NO_DIRECTION = 255
+
+
+"""
+Returns a table of compass point index for each of the ADC codes, each
+code maps to the nearest vane voltage. Codes out of tolerance are
+NO_DIRECTION.
+"""
+
+
+def build_direction_table():
+    volts = np.arange(ADC_CODES) * (VANE_REFERENCE_VOLTS / (ADC_CODES - 1))
+    vane_volts = np.array(list(VANE_VOLTS.keys()))
+    vane_points = np.array([COMPASS_POINTS.index(p) for p in VANE_VOLTS.values()])
+
+    distance = np.abs(volts[:, np.newaxis] - vane_volts[np.newaxis, :])
+    nearest = distance.argmin(axis=1)
+    table = vane_points[nearest].astype(np.uint8)
+    table[distance.min(axis=1) > VANE_TOLERANCE_VOLTS] = NO_DIRECTION
+    return table
+
+
+DIRECTION_TABLE = build_direction_table()
 
 
 class WindDirection:
+    """ Wind Direction uses a set of reed switches to create a voltage divider.
+    A magnet in the vane can close 1 or 2 switchs thus providing 16 values.
+    Each raw 10 bit ADC reading is classified with DIRECTION_TABLE, a reading
+    between two vane voltages gives the nearest one. Create one WindDirection
+    and keep it, each one opens the SPI device."""
+
     def __init__(self):
+        from hardware import MCP3008
+
         self.vane = MCP3008(channel=0)
-        self.volts = {
-            0.4: "N",
-            1.4: "NNE",
-            1.2: "NE",
-            2.8: "ENE",
-            2.7: "E",
-            2.9: "ESE",
-            2.2: "SE",
-            2.5: "SSE",
-            1.8: "S",
-            2.0: "SSW",
-            0.7: "SW",
-            0.8: "WSW",
-            0.1: "W",
-            0.3: "WNW",
-            0.2: "NW",
-            0.6: "NNW",
-        }
+        self.table = DIRECTION_TABLE
 
-    """ Wind Direction uses a set of reed switches to create a voltage divider.
-    A magnet in the vane can close 1 or 2 switchs thus providing 16 values.
-    It is possible for a measurement to occur when voltages are changing thus
-    producing a invalid result (None)"""
+    # Index into COMPASS_POINTS, NO_DIRECTION if reading is out of tolerance
+    def get_direction_code(self):
+        return int(self.table[self.vane.raw_value])
 
     def get_direction(self):
-        reading_raw = self.vane.value * 3.29
-        reading = round(reading_raw, 1)
-        if reading in self.volts:
-            logging.debug("A2D = %.03f", reading_raw)
-            result = self.volts[reading]
-            # print(result, reading, reading_raw)
-            return result
-        else:
-            logging.debug("A2D = %.03f - None", reading_raw)
-            # print("Vane output not in list:", reading, reading_raw)
+        code = self.get_direction_code()
+        if code == NO_DIRECTION:
+            logging.debug("A2D out of range - None")
             return None
+        return COMPASS_POINTS[code]
+
+
+class VaneSampler:
+    """
+    Samples the vane in a background thread so direction is read many times
+    per measurement window without delaying the main loop.
+    direction: WindDirection to read
+    rate: samples per second
+    capacity: samples kept per window, later samples are dropped
+    clock: hardware.clock if None, see sample_every()
+    """
+
+    def __init__(self, direction, rate, capacity, clock=None):
+        if clock is None:
+            from hardware import clock
+        self.direction = direction
+        self.rate = rate
+        self.clock = clock
+        self.codes = np.full(capacity, NO_DIRECTION, dtype=np.uint8)
+        self.times = np.zeros(capacity)
+        self.count = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.count = 0
+        self.stop_event.clear()
+        self.thread = self.clock.sample_every(
+            1.0 / self.rate, self._sample, self.stop_event
+        )
+
+    """
+    Stops sampling, returns (times, codes) of the valid samples after the
+    glitch filter.
+    """
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+        codes = majority_filter(self.codes[: self.count])
+        valid = codes != NO_DIRECTION
+        return self.times[: self.count][valid], codes[valid]
+
+    def _sample(self):
+        if self.count < len(self.codes):
+            self.codes[self.count] = self.direction.get_direction_code()
+            self.times[self.count] = self.clock.monotonic()
+            self.count += 1
+
+
+"""
+Majority of 3 filter over consecutive direction codes. A single sample that
+differs from equal neighbours, as read while the vane magnet moves between
+reed switches, is replaced by its neighbours' value.
+"""
+
+
+def majority_filter(codes):
+    filtered = codes.copy()
+    if len(codes) > 2:
+        before = codes[:-2]
+        middle = codes[1:-1]
+        after = codes[2:]
+        glitch = (before == after) & (middle != before)
+        filtered[1:-1][glitch] = before[glitch]
+    return filtered
+
+
+# Nearest compass point to direction in degrees, None if direction is NaN
+def compass_point(degrees):
+    if math.isnan(degrees):
+        return None
+    return COMPASS_POINTS[int(round(degrees / DEGREES_PER_POINT)) % len(COMPASS_POINTS)]
+
+
+"""
+speeds: wind speed of each sample
+directions: direction of each sample in degrees, NaN if not measured
+Directions are averaged as unit vectors, so 350 and 10 degrees average to
+0 not 180. direction_std is the Yamartino estimate of the standard deviation
+of direction. Directions are NaN if no sample had a direction.
+"""
+
+
+def wind_vector_statistics(speeds, directions):
+    valid = ~np.isnan(directions)
+    radians = np.radians(directions[valid])
+    sines = np.sin(radians)
+    cosines = np.cos(radians)
+
+    direction = weighted_direction = direction_std = math.nan
+    if len(radians):
+        mean_sin = sines.mean()
+        mean_cos = cosines.mean()
+        direction = math.degrees(math.atan2(mean_sin, mean_cos)) % 360.0
+
+        weights = speeds[valid]
+        if weights.sum() > 0:
+            weighted_direction = (
+                math.degrees(math.atan2(weights @ sines, weights @ cosines)) % 360.0
+            )
+        else:
+            weighted_direction = direction
+
+        epsilon = math.sqrt(max(0.0, 1.0 - (mean_sin**2 + mean_cos**2)))
+        direction_std = math.degrees(
+            math.asin(epsilon) * (1.0 + (2.0 / math.sqrt(3.0) - 1.0) * epsilon**3)
+        )
+
+    return WindVector(
+        float(speeds.mean()),
+        float(speeds.max()),
+        direction,
+        weighted_direction,
+        direction_std,
+    )
 
 
 if __name__ == "__main__":
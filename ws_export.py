@@ -0,0 +1,261 @@
+import io
+import os
+import csv
+import gzip
+import time
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from ws_reader import WeatherReader, read_type
+from flat_interface import RowEncoder
+from columnar_interface import TIME_COLUMNS, pack_header
+
+# Optional, smaller and faster than gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""Bulk export of the sensors table for analysis, in the formats the
+station writes:
+
+    csv       as CsvDatabase, header then one row per record
+    jsonl     as FlatDatabase, one json object per line, see RowEncoder
+    columnar  as ColumnarDatabase, read with columnar_interface.load()
+
+Rows are streamed with WeatherReader, keyset pages read with an unbuffered
+cursor and fetchmany(), so memory stays the same for any range. csv and
+jsonl output can be gzip or zstd compressed, zstd needs the zstandard
+package. columnar output is never compressed, load() maps the file as is.
+
+Each file is written to a hidden .tmp name and renamed once complete, as
+parquet_interface does, so a failed or killed export leaves no partial file
+under the final name.
+
+With --split the range is cut into months or days exported to separate
+files by a pool of worker processes, each with its own connection:
+
+    python3 ws_export.py --format jsonl --compress zstd --split month --workers 4 history"""
+
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "columnar": ".bin"}
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def open_output(file_name, compress, text):
+    if compress == "gzip":
+        handle = gzip.open(file_name, "wb")
+    elif compress == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd needs the zstandard package")
+        handle = zstandard.ZstdCompressor().stream_writer(open(file_name, "wb"))
+    else:
+        handle = open(file_name, "wb")
+    if text:
+        # Same text as the station files, OS line terminator from the writers
+        return io.TextIOWrapper(handle, encoding="utf-8", newline="")
+    return handle
+
+
+def check_output(file_format, compress):
+    if file_format not in FORMATS:
+        raise ValueError("Unknown format {}".format(file_format))
+    if compress not in COMPRESSIONS:
+        raise ValueError("Unknown compression {}".format(compress))
+    if file_format == "columnar" and compress != "none":
+        raise ValueError("columnar output can not be compressed, see load()")
+
+
+# Database times as the station writes them
+def _text_rows(rows, time_indexes):
+    for row in rows:
+        if time_indexes:
+            row = list(row)
+            for index in time_indexes:
+                if row[index] is not None:
+                    row[index] = row[index].strftime(TIME_FORMAT)
+        yield row
+
+
+"""
+Writes the rows from first up to, not including, last to file_name and
+returns the number of rows. See WeatherReader.row_batches() for first, last
+and columns.
+"""
+
+
+def export(
+    file_name,
+    first=None,
+    last=None,
+    columns=None,
+    file_format="csv",
+    compress="none",
+    db_config="json_frontend.load",
+    batch_size=5000,
+):
+    check_output(file_format, compress)
+    directory, base_name = os.path.split(file_name)
+    temp_name = os.path.join(directory, "." + base_name + ".tmp")
+    reader = WeatherReader(db_config, batch_size=batch_size)
+    count = 0
+    try:
+        columns = reader.check_columns(columns)
+        time_indexes = [i for i, name in enumerate(columns) if name in TIME_COLUMNS]
+        with open_output(temp_name, compress, file_format != "columnar") as f:
+            if file_format == "columnar":
+                # Batches have the record layout of the columnar format
+                f.write(pack_header([[name, read_type(name)] for name in columns]))
+                for batch in reader.batches(first, last, columns):
+                    f.write(batch.tobytes())
+                    count += len(batch)
+            elif file_format == "jsonl":
+                encoder = RowEncoder(columns, os.linesep)
+                for batch in reader.row_batches(first, last, columns):
+                    f.write(encoder.encode_rows(_text_rows(batch, time_indexes)))
+                    count += len(batch)
+            else:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                writer.writerow(columns)
+                for batch in reader.row_batches(first, last, columns):
+                    writer.writerows(_text_rows(batch, time_indexes))
+                    count += len(batch)
+        with open(temp_name, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    finally:
+        reader.close()
+    logging.info("EXPORT: %s, %s rows", file_name, count)
+    return count
+
+
+def _next_month(t):
+    if t.month == 12:
+        return t.replace(year=t.year + 1, month=1)
+    return t.replace(month=t.month + 1)
+
+
+# Disjoint (first, last) ranges covering first up to last
+def split_range(first, last, split):
+    if split == "month":
+        start = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        step = _next_month
+    else:
+        start = first.replace(hour=0, minute=0, second=0, microsecond=0)
+        step = lambda t: t + timedelta(days=1)
+    ranges = []
+    while start < last:
+        end = step(start)
+        ranges.append((max(start, first), min(end, last)))
+        start = end
+    return ranges
+
+
+def _export_part(arguments):
+    return export(**arguments)
+
+
+"""
+Exports each range of split_range() to <prefix>.<start>.<extension> with
+workers processes and returns the total rows. first and last default to the
+first and last times in the table.
+"""
+
+
+def export_parallel(
+    prefix,
+    first=None,
+    last=None,
+    split="month",
+    workers=4,
+    file_format="csv",
+    compress="none",
+    **kwargs
+):
+    check_output(file_format, compress)
+    if first is None or last is None:
+        reader = WeatherReader(kwargs.get("db_config", "json_frontend.load"))
+        try:
+            table_first, table_last = reader.time_range()
+        finally:
+            reader.close()
+        if table_first is None:
+            return 0
+        first = first or table_first
+        last = last or table_last + timedelta(seconds=1)
+
+    extension = FORMATS[file_format] + COMPRESSIONS[compress]
+    label = "%Y-%m" if split == "month" else "%Y-%m-%d"
+    parts = [
+        dict(
+            kwargs,
+            file_name="{}.{}{}".format(prefix, start.strftime(label), extension),
+            first=start,
+            last=end,
+            file_format=file_format,
+            compress=compress,
+        )
+        for start, end in split_range(first, last, split)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_export_part, parts))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    parser = argparse.ArgumentParser(description="Export the sensors table")
+    parser.add_argument("output", help="file name, or prefix with --split")
+    parser.add_argument("--config", default="json_frontend.load", help="json credentials file")
+    parser.add_argument("--format", default="csv", choices=list(FORMATS))
+    parser.add_argument("--compress", default="none", choices=list(COMPRESSIONS))
+    parser.add_argument("--first", default=None, help="first day, YYYY-MM-DD")
+    parser.add_argument("--last", default=None, help="day after last, YYYY-MM-DD")
+    parser.add_argument("--columns", default=None, help="comma separated, default all")
+    parser.add_argument("--split", default=None, choices=["month", "day"])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    try:
+        check_output(args.format, args.compress)
+    except ValueError as e:
+        parser.error(str(e))
+
+    day = lambda value: datetime.strptime(value, "%Y-%m-%d") if value else None
+    columns = args.columns.split(",") if args.columns else None
+
+    start = time.monotonic()
+    if args.split:
+        rows = export_parallel(
+            args.output,
+            day(args.first),
+            day(args.last),
+            args.split,
+            args.workers,
+            args.format,
+            args.compress,
+            columns=columns,
+            db_config=args.config,
+        )
+    else:
+        rows = export(
+            args.output,
+            day(args.first),
+            day(args.last),
+            columns,
+            args.format,
+            args.compress,
+            args.config,
+        )
+    seconds = time.monotonic() - start
+    print(
+        "{} rows in {:.01f} s, {:.0f} rows/s".format(
+            rows, seconds, rows / seconds if seconds > 0 else 0
+        )
+    )
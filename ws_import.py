@@ -0,0 +1,229 @@
+import csv
+import json
+import math
+import time
+import logging
+from itertools import islice
+
+from errors import ErrorNetworkIssue
+from db_interface import MariaDatabase
+
+"""Bulk import of csv_data.*.txt and flat_data.*.txt files into MariaDB,
+e.g. the NAS files written while the database was disabled or down:
+
+    python3 ws_import.py --config json_backend.load /mnt/NAS/Weather_data/csv_data.*.txt
+
+Files are streamed, a csv file must start with the column_names header as
+CsvDatabase writes it, every json line must have the same keys. Rows are
+inserted chunk_size at a time with one executemany() and one commit per
+chunk through MariaDatabase, so w_dir_code and WS_ROLLUPS apply as for
+the station. Rows whose time is already in the table are skipped, a file
+can be imported again after an import was cut short.
+
+The user needs INSERT on the sensors table, SELECT to skip rows already
+stored, and with WS_ROLLUPS SELECT, INSERT and DELETE on the rollup tables.
+createdb.sql only grants the backend user INSERT, add e.g.:
+
+    GRANT SELECT, INSERT ON weather_data.sensors TO 'backend'@'localhost';
+    GRANT SELECT, INSERT, DELETE ON weather_data.sensors_hourly TO 'backend'@'localhost';
+    GRANT SELECT, INSERT, DELETE ON weather_data.sensors_daily TO 'backend'@'localhost';
+    GRANT SELECT, INSERT, DELETE ON weather_data.sensors_monthly TO 'backend'@'localhost';
+
+A database that cannot be reached ends the import, exit status 1, rows
+inserted so far are committed."""
+
+TIME_COLUMN = "time"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def check_header(file_name, fields, column_names):
+    if len(fields) != len(column_names):
+        raise ValueError("{}: header is not the same length".format(file_name))
+    for index, value in enumerate(fields):
+        if value.strip() != column_names[index]:
+            raise ValueError("{}: header does NOT match".format(file_name))
+
+
+# Empty csv fields and NaN are stored as NULL
+def _clean(value):
+    if value == "" or value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str) and value.lower() == "nan":
+        return None
+    return value
+
+
+def _is_json_lines(file_name):
+    with open(file_name, "r") as f:
+        for line in f:
+            if line.strip():
+                return line.lstrip().startswith("{")
+    return False
+
+
+# Header of a file, for column_names when none are given
+def file_columns(file_name):
+    with open(file_name, "r", newline="") as f:
+        if _is_json_lines(file_name):
+            for line in f:
+                if line.strip():
+                    return list(json.loads(line).keys())
+            return []
+        return [value.strip() for value in next(csv.reader(f), [])]
+
+
+def read_csv(file_name, column_names):
+    with open(file_name, "r", newline="") as f:
+        reader = csv.reader(f)
+        check_header(file_name, next(reader, []), column_names)
+        for number, row in enumerate(reader, 2):
+            if not row:
+                continue
+            if len(row) != len(column_names):
+                logging.warning("IMPORT: %s line %s skipped, %s fields", file_name, number, len(row))
+                continue
+            yield tuple(_clean(value) for value in row)
+
+
+def read_json_lines(file_name, column_names):
+    with open(file_name, "r") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            check_header("{} line {}".format(file_name, number), list(record), column_names)
+            yield tuple(_clean(record[name]) for name in column_names)
+
+
+def read_file(file_name, column_names):
+    if _is_json_lines(file_name):
+        return read_json_lines(file_name, column_names)
+    return read_csv(file_name, column_names)
+
+
+class Importer:
+    """
+    column_names: columns of the files, see file_columns()
+    db_config: json credentials file, see MariaDatabase
+    chunk_size: rows per executemany() and commit
+    skip_existing: skip rows whose time is already in the table
+    """
+
+    def __init__(self, column_names, db_config=None, chunk_size=5000, skip_existing=True):
+        self.column_names = column_names
+        self.chunk_size = chunk_size
+        for name in column_names:
+            if not name.isidentifier():
+                raise ValueError("Bad column name {!r}".format(name))
+        self.time_index = column_names.index(TIME_COLUMN) if skip_existing else None
+
+        self.db = MariaDatabase(column_names, db_config)
+        self.read = 0
+        self.inserted = 0
+        self.skipped = 0
+
+    def _time_text(self, value):
+        if isinstance(value, str):
+            return value
+        return value.strftime(TIME_FORMAT)
+
+    # Rows of chunk whose time is not in the table or earlier in chunk
+    def _new_rows(self, chunk):
+        times = [row[self.time_index] for row in chunk if row[self.time_index]]
+        if not times:
+            return chunk
+        self.db.cursor.execute(
+            "SELECT `time` FROM {} WHERE `time` >= %s AND `time` <= %s".format(
+                self.db.db_table
+            ),
+            (min(times), max(times)),
+        )
+        seen = {self._time_text(row[0]) for row in self.db.cursor.fetchall()}
+        rows = []
+        for row in chunk:
+            if row[self.time_index] in seen:
+                continue
+            seen.add(row[self.time_index])
+            rows.append(row)
+        return rows
+
+    def import_rows(self, rows):
+        rows = iter(rows)
+        self.db.open_db()
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.read += len(chunk)
+                if self.time_index is not None:
+                    new_rows = self._new_rows(chunk)
+                    self.skipped += len(chunk) - len(new_rows)
+                    chunk = new_rows
+                if chunk:
+                    self.db.send_data(chunk, multi_entry=True)
+                    self.inserted += len(chunk)
+        finally:
+            self.db.close_db()
+
+    def import_files(self, file_names):
+        start = time.monotonic()
+        for file_name in file_names:
+            logging.info("IMPORT: %s", file_name)
+            self.import_rows(read_file(file_name, self.column_names))
+        seconds = time.monotonic() - start
+        logging.info(
+            "IMPORT: %s rows read, %s inserted, %s skipped in %.01f s, %.0f rows/s",
+            self.read,
+            self.inserted,
+            self.skipped,
+            seconds,
+            self.read / seconds if seconds > 0 else 0,
+        )
+        return seconds
+
+    def close(self):
+        self.db.close_pool()
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    parser = argparse.ArgumentParser(description="Import csv and json lines files")
+    parser.add_argument("files", nargs="+", help="csv_data.*.txt or flat_data.*.txt")
+    parser.add_argument("--config", default=None, help="json credentials file")
+    parser.add_argument("--columns", default=None, help="comma separated, default header")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--no-skip", action="store_true", help="insert rows already stored")
+    args = parser.parse_args()
+
+    if args.columns:
+        column_names = args.columns.split(",")
+    else:
+        column_names = file_columns(args.files[0])
+
+    importer = Importer(column_names, args.config, args.chunk_size, not args.no_skip)
+    try:
+        seconds = importer.import_files(args.files)
+    except ValueError as e:
+        logging.error("IMPORT: %s", e)
+        sys.exit(1)
+    except ErrorNetworkIssue:
+        logging.error(
+            "IMPORT: Database not reachable, %s rows inserted before", importer.inserted
+        )
+        sys.exit(1)
+    finally:
+        importer.close()
+    print(
+        "{} rows inserted, {} skipped, {:.0f} rows/s".format(
+            importer.inserted,
+            importer.skipped,
+            importer.read / seconds if seconds > 0 else 0,
+        )
+    )
@@ -0,0 +1,242 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+import mysql.connector
+
+from errors import ErrorNetworkIssue
+from db_interface import MariaDatabase
+from wind_direction import COMPASS_POINTS, NO_DIRECTION
+from columnar_interface import (
+    TIME_COLUMNS,
+    DIRECTION_COLUMNS,
+    column_type,
+    epoch_seconds,
+)
+
+"""Streaming reads of the sensors table with the frontend credentials.
+
+Rows are read in pages with keyset pagination on (time, id). Each page
+starts after the last row of the one before, so the server finds the page
+start with the time index and never skips over rows like OFFSET does. A page
+is read with an unbuffered cursor, fetchmany() takes batch_size rows at a
+time off the socket, so memory stays the same for a day or a year:
+
+    reader = WeatherReader()
+    for time, temp in reader.rows(datetime(2021, 1, 1), datetime(2022, 1, 1), ["time", "temp"]):
+        ...
+    for batch in reader.batches(first, last, ["time", "temp"]):
+        plot(batch["time"], batch["temp"])
+
+Column names are checked against the columns of the table, only those are
+put in the query."""
+
+# Tie breaker of the keyset, time is not unique
+KEY_COLUMNS = ("time", "id")
+
+# NumPy types of columns not in columnar_interface.column_type()
+READ_TYPES = {"id": "<i8", "station_id": "<u2", "w_dir_code": "<u1"}
+
+
+def read_type(name):
+    return READ_TYPES.get(name, column_type(name))
+
+
+class WeatherReader:
+    """
+    db_config: json credentials file, see MariaDatabase
+    page_size: rows per query, a query holds its snapshot until read
+    batch_size: rows per fetchmany() and per NumPy batch
+    """
+
+    def __init__(self, db_config="json_frontend.load", page_size=50000, batch_size=5000):
+        self.db = MariaDatabase([], db_config)
+        self.table = self.db.db_table
+        self.page_size = page_size
+        self.batch_size = batch_size
+
+        self.connection = None
+        self.table_columns = None
+        self.directions = {point: code for code, point in enumerate(COMPASS_POINTS)}
+
+    def _connect(self):
+        if self.connection is None or not self.connection.is_connected():
+            try:
+                # Rows left unread by a consumer that stopped early are
+                # read off the socket before the next query
+                self.connection = mysql.connector.connect(
+                    **self.db.connection_params, consume_results=True
+                )
+            except (
+                mysql.connector.errors.OperationalError,
+                mysql.connector.errors.InterfaceError,
+            ) as e:
+                logging.info("READER: Connect failed: %s", e)
+                raise ErrorNetworkIssue
+        return self.connection
+
+    # Column names of the table, read once
+    def columns(self):
+        if self.table_columns is None:
+            cursor = self._connect().cursor()
+            cursor.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+                "ORDER BY ORDINAL_POSITION",
+                (self.table,),
+            )
+            self.table_columns = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return self.table_columns
+
+    # Column names to read, columns checked against the table
+    def check_columns(self, columns):
+        if columns is None:
+            return [name for name in self.columns() if name != "id"]
+        unknown = [name for name in columns if name not in self.columns()]
+        if unknown:
+            raise ValueError("Unknown columns {}".format(", ".join(unknown)))
+        return list(columns)
+
+    # (first, last) times of the table, None if empty
+    def time_range(self):
+        cursor = self._connect().cursor()
+        cursor.execute("SELECT MIN(`time`), MAX(`time`) FROM " + self.table)
+        first, last = cursor.fetchone()
+        cursor.close()
+        return first, last
+
+    def _page_sql(self, columns, first, last, after):
+        where = []
+        parameters = []
+        if after is not None:
+            # Written out so the time index is used, (time, id) > (t, i) is not
+            where.append("(`time` > %s OR (`time` = %s AND `id` > %s))")
+            parameters += [after[0], after[0], after[1]]
+        elif first is not None:
+            where.append("`time` >= %s")
+            parameters.append(first)
+        if last is not None:
+            where.append("`time` < %s")
+            parameters.append(last)
+
+        sql = "SELECT {} FROM {}{} ORDER BY `time`, `id` LIMIT {}".format(
+            ", ".join("`{}`".format(name) for name in list(KEY_COLUMNS) + columns),
+            self.table,
+            " WHERE " + " AND ".join(where) if where else "",
+            int(self.page_size),
+        )
+        return sql, parameters
+
+    """
+    Yields lists of up to batch_size tuples of columns, the rows from first
+    up to, not including, last. first and last are datetimes, strings as
+    the station writes them, or None for no limit. columns is a list of
+    column names, None for every column but id. The generator can be
+    closed before the end, e.g. by break.
+    """
+
+    def row_batches(self, first=None, last=None, columns=None):
+        columns = self.check_columns(columns)
+        after = None
+        while True:
+            sql, parameters = self._page_sql(columns, first, last, after)
+            cursor = self._connect().cursor(buffered=False)
+            try:
+                cursor.execute(sql, parameters)
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    after = rows[-1][:2]
+                    yield [row[2:] for row in rows]
+            except (
+                mysql.connector.errors.OperationalError,
+                mysql.connector.errors.InterfaceError,
+            ) as e:
+                logging.info("READER: Read failed: %s", e)
+                self.connection = None
+                raise ErrorNetworkIssue
+            finally:
+                try:
+                    cursor.close()
+                except mysql.connector.Error as e:
+                    # Unread rows, e.g. the generator was closed mid page
+                    logging.debug("READER: Connection dropped closing cursor: %s", e)
+                    self.close()
+            if count < self.page_size:
+                return
+
+    # Yields the rows of row_batches() one at a time
+    def rows(self, first=None, last=None, columns=None):
+        for batch in self.row_batches(first, last, columns):
+            yield from batch
+
+    # Converts a list of rows to a NumPy structured array, types as stored by
+    # columnar_interface, NULL is NaN or NO_DIRECTION
+    def to_array(self, columns, rows):
+        dtype = np.dtype([(name, read_type(name)) for name in columns])
+        array = np.empty(len(rows), dtype=dtype)
+        for index, name in enumerate(columns):
+            values = [row[index] for row in rows]
+            if name in TIME_COLUMNS:
+                array[name] = [epoch_seconds(value) for value in values]
+            elif name in DIRECTION_COLUMNS:
+                array[name] = [self.directions.get(value, NO_DIRECTION) for value in values]
+            elif name == "w_dir_code":
+                array[name] = [NO_DIRECTION if value is None else value for value in values]
+            elif dtype[name].kind == "f":
+                array[name] = [np.nan if value is None else value for value in values]
+            else:
+                array[name] = values
+        return array
+
+    # As row_batches(), each batch a NumPy structured array
+    def batches(self, first=None, last=None, columns=None):
+        columns = self.check_columns(columns)
+        for batch in self.row_batches(first, last, columns):
+            yield self.to_array(columns, batch)
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception as e:
+                logging.debug("READER: Ignored error closing connection: %s", e)
+            self.connection = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    parser = argparse.ArgumentParser(description="Read the sensors table")
+    parser.add_argument("--config", default="json_frontend.load", help="json credentials file")
+    parser.add_argument("--first", default=None, help="first day, YYYY-MM-DD")
+    parser.add_argument("--last", default=None, help="day after last, YYYY-MM-DD")
+    parser.add_argument("--columns", default="time,temp", help="comma separated")
+    args = parser.parse_args()
+
+    day = lambda value: datetime.strptime(value, "%Y-%m-%d") if value else None
+    columns = args.columns.split(",")
+
+    reader = WeatherReader(args.config)
+    try:
+        rows = 0
+        sums = {}
+        for batch in reader.batches(day(args.first), day(args.last), columns):
+            rows += len(batch)
+            for name in columns:
+                if batch.dtype[name].kind == "f":
+                    total = sums.setdefault(name, [0.0, 0])
+                    total[0] += float(np.nansum(batch[name]))
+                    total[1] += int(np.count_nonzero(~np.isnan(batch[name])))
+        print("{} rows".format(rows))
+        for name, (total, count) in sums.items():
+            if count:
+                print("{}: mean {:.2f}".format(name, total / count))
+    finally:
+        reader.close()